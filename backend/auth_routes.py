@@ -3,12 +3,20 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional, Dict, Any
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, timedelta
-import hashlib
+import asyncio
+import os
+import heapq
+import threading
+import time
 import uuid
 import jwt
 import secrets
 from sqlalchemy import Column, Integer, String, Text, DateTime, create_engine
 
+from token_cache import TokenCache
+from passwords import hash_password, verify_password
+from state_backend import state_backend
+
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 # Модели Pydantic для валидации
@@ -40,21 +48,65 @@ users_storage = {}
 sessions_storage = {}
 refresh_tokens_storage = {}
 
+# Уникальные индексы пользователей: {значение поля: user_id}
+# Деактивированные пользователи остаются в индексах, их логин и email заняты
+user_indexes = {
+    "login": {},
+    "username": {},
+    "email": {}
+}
+# Блокировка пользователей, индексов и refresh токенов: обработчики меняют их
+# в event loop, а записи других воркеров применяются из потоков (см. state_backend.sync).
+# Изменение и запись в журнал идут под одной блокировкой, чтобы порядок совпадал.
+# Внутри нет await, поэтому event loop она не держит надолго
+auth_lock = threading.RLock()
+
 # Настройки JWT
-SECRET_KEY = secrets.token_urlsafe(32)
+# Ключ нужно задать через окружение, иначе после перезапуска все токены станут невалидными
+SECRET_KEY = os.getenv("SECRET_KEY") or secrets.token_urlsafe(32)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Сколько проверенных access токенов держать в кеше
+ACCESS_TOKEN_CACHE_SIZE = 10000
+# Как часто удалять просроченные refresh токены
+REFRESH_TOKEN_CLEANUP_INTERVAL_SECONDS = 300
+
+access_token_cache = TokenCache(ACCESS_TOKEN_CACHE_SIZE)
+# Очередь истечения refresh токенов: [(exp timestamp, token)]
+refresh_tokens_expiry = []
 
 security = HTTPBearer()
 
-def hash_password(password: str) -> str:
-    """Хеширование пароля"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def find_user_by(field: str, value: str) -> Optional[Dict[str, Any]]:
+    """Поиск пользователя по уникальному полю (login, username, email)"""
+    user_id = user_indexes[field].get(value)
+    return users_storage.get(user_id) if user_id is not None else None
+
+def index_user(user: Dict[str, Any]):
+    """Добавление пользователя в уникальные индексы"""
+    for field, index in user_indexes.items():
+        index[user[field]] = user["id"]
+
+def ensure_login_free(login: str):
+    """Ошибка 400, если логин уже занят в любом из уникальных индексов"""
+    if any(find_user_by(field, login) for field in user_indexes):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Пользователь с таким логином уже существует"
+        )
+
+def save_user(user: Dict[str, Any]) -> int:
+    """Запись нового состояния пользователя в журнал, возвращает номер записи (под auth_lock)"""
+    return state_backend.append("auth", {"op": "user", "user": dict(user)})
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверка пароля"""
-    return hash_password(plain_password) == hashed_password
+def reindex_user_field(user: Dict[str, Any], field: str, value: str):
+    """Изменение индексируемого поля пользователя"""
+    index = user_indexes[field]
+    if index.get(user[field]) == user["id"]:
+        del index[user[field]]
+    user[field] = value
+    index[value] = user["id"]
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Создание JWT токена"""
@@ -84,10 +136,57 @@ def verify_token(token: str) -> Optional[dict]:
     except jwt.PyJWTError:
         return None
 
+def _put_refresh_token(refresh_token: str, token_data: Dict[str, Any]):
+    if refresh_token not in refresh_tokens_storage:
+        heapq.heappush(refresh_tokens_expiry, (token_data["expires_at"], refresh_token))
+    refresh_tokens_storage[refresh_token] = token_data
+
+def store_refresh_token(refresh_token: str, user_id: str) -> int:
+    """Сохранение выданного refresh токена, возвращает номер записи журнала"""
+    token_data = {
+        "user_id": user_id,
+        "created_at": datetime.now().isoformat(),
+        "expires_at": time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600
+    }
+    with auth_lock:
+        _put_refresh_token(refresh_token, token_data)
+        return state_backend.append("auth", {"op": "refresh_token", "token": refresh_token, "data": token_data})
+
+def revoke_refresh_token(refresh_token: str) -> Optional[int]:
+    """
+    Удаление refresh токена (выход, обновление или истечение срока).
+    Возвращает номер записи журнала или None, если токена нет
+    """
+    with auth_lock:
+        if refresh_tokens_storage.pop(refresh_token, None) is None:
+            return None
+        return state_backend.append("auth", {"op": "refresh_token_revoked", "token": refresh_token})
+
+def cleanup_expired_refresh_tokens(now: Optional[float] = None) -> int:
+    """Удаление refresh токенов с истекшим сроком"""
+    now = now or time.time()
+    removed = 0
+    with auth_lock:
+        while refresh_tokens_expiry and refresh_tokens_expiry[0][0] <= now:
+            _, refresh_token = heapq.heappop(refresh_tokens_expiry)
+            if revoke_refresh_token(refresh_token) is not None:
+                removed += 1
+    return removed
+
+async def refresh_token_cleanup_loop():
+    """Фоновая задача: периодическое удаление просроченных refresh токенов"""
+    while True:
+        await asyncio.sleep(REFRESH_TOKEN_CLEANUP_INTERVAL_SECONDS)
+        cleanup_expired_refresh_tokens()
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
     """Получение текущего пользователя из токена"""
     token = credentials.credentials
-    payload = verify_token(token)
+    payload = access_token_cache.get(token)
+    if payload is None:
+        payload = verify_token(token)
+        if payload is not None and payload.get("type") == "access":
+            access_token_cache.put(token, payload)
     
     if payload is None or payload.get("type") != "access":
         raise HTTPException(
@@ -117,21 +216,18 @@ async def register(user_data: UserRegister):
     Регистрация нового пользователя
     """
     # Проверяем, существует ли пользователь с таким login
-    for user in users_storage.values():
-        if user["login"] == user_data.login:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Пользователь с таким логином уже существует"
-            )
+    # (login используется и как username, и как email)
+    ensure_login_free(user_data.login)
     
     # Создаем нового пользователя
+    hashed_password = await hash_password(user_data.password)
     user_id = str(uuid.uuid4())
     new_user = {
         "id": user_id,
         "name": user_data.name,
         "role": user_data.role,
         "login": user_data.login,
-        "hashed_password": hash_password(user_data.password),
+        "hashed_password": hashed_password,
         "username": user_data.login,  # Добавляем username для совместимости
         "email": user_data.login,     # Используем login как email
         "full_name": user_data.name,
@@ -140,7 +236,15 @@ async def register(user_data: UserRegister):
         "last_login": datetime.now().isoformat()
     }
     
-    users_storage[user_id] = new_user
+    with auth_lock:
+        # Пока считался хеш, тот же логин мог занять параллельный запрос
+        # (или запись другого воркера): проверка и вставка под одной блокировкой
+        ensure_login_free(user_data.login)
+        users_storage[user_id] = new_user
+        index_user(new_user)
+        seq = save_user(new_user)
+    # Отвечаем, только когда пользователь записан на диск
+    await state_backend.wait_durable_async(seq)
     
     return {
         "message": "Пользователь успешно зарегистрирован",
@@ -154,13 +258,13 @@ async def login(user_data: UserLogin, response: Response):
     Вход в систему
     """
     # Ищем пользователя по username (который равен login)
-    user = None
-    for u in users_storage.values():
-        if u["username"] == user_data.username:
-            user = u
-            break
+    user = find_user_by("username", user_data.username)
+    verified_hash = user["hashed_password"] if user is not None else None
     
-    if user is None or not verify_password(user_data.password, user["hashed_password"]):
+    is_valid, needs_rehash = (False, False) if user is None else await verify_password(
+        user_data.password, verified_hash
+    )
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль"
@@ -172,18 +276,24 @@ async def login(user_data: UserLogin, response: Response):
             detail="Аккаунт деактивирован"
         )
     
-    # Обновляем время последнего входа
-    user["last_login"] = datetime.now().isoformat()
+    # Пароли в старом формате (sha256 без соли) пересчитываем при входе
+    new_hash = await hash_password(user_data.password) if needs_rehash else None
+    
+    with auth_lock:
+        # Пока считался хеш, пароль могли сменить - тогда новый пароль не трогаем
+        if new_hash is not None and user["hashed_password"] == verified_hash:
+            user["hashed_password"] = new_hash
+        # Обновляем время последнего входа
+        user["last_login"] = datetime.now().isoformat()
+        save_user(user)
     
     # Создаем токены
     access_token = create_access_token(data={"sub": user["id"]})
     refresh_token = create_refresh_token(data={"sub": user["id"]})
     
-    # Сохраняем refresh токен
-    refresh_tokens_storage[refresh_token] = {
-        "user_id": user["id"],
-        "created_at": datetime.now().isoformat()
-    }
+    # Сохраняем refresh токен (записи журнала идут по порядку, поэтому
+    # его сохранение означает, что и пользователь сохранен)
+    await state_backend.wait_durable_async(store_refresh_token(refresh_token, user["id"]))
     
     # Устанавливаем refresh token в httpOnly cookie
     response.set_cookie(
@@ -239,11 +349,8 @@ async def refresh_token(request: Request):
     new_refresh_token = create_refresh_token(data={"sub": user_id})
     
     # Удаляем старый refresh token и сохраняем новый
-    del refresh_tokens_storage[refresh_token]
-    refresh_tokens_storage[new_refresh_token] = {
-        "user_id": user_id,
-        "created_at": datetime.now().isoformat()
-    }
+    revoke_refresh_token(refresh_token)
+    await state_backend.wait_durable_async(store_refresh_token(new_refresh_token, user_id))
     
     return {
         "access_token": new_access_token,
@@ -258,8 +365,8 @@ async def logout(response: Response, request: Request):
     """
     refresh_token = request.cookies.get("refresh_token")
     
-    if refresh_token and refresh_token in refresh_tokens_storage:
-        del refresh_tokens_storage[refresh_token]
+    if refresh_token:
+        await state_backend.wait_durable_async(revoke_refresh_token(refresh_token) or 0)
     
     # Удаляем cookie
     response.delete_cookie("refresh_token")
@@ -290,17 +397,27 @@ async def update_current_user_info(
     """
     allowed_fields = ["full_name", "email"]
     
-    for field, value in update_data.items():
-        if field in allowed_fields and value is not None:
-            # Проверяем уникальность email
-            if field == "email":
-                for user in users_storage.values():
-                    if user["email"] == value and user["id"] != current_user["id"]:
+    with auth_lock:
+        for field, value in update_data.items():
+            if field in allowed_fields and value is not None:
+                # Проверяем уникальность email
+                if field == "email":
+                    if not isinstance(value, str):
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Email должен быть строкой"
+                        )
+                    user = find_user_by("email", value)
+                    if user is not None and user["id"] != current_user["id"]:
                         raise HTTPException(
                             status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Пользователь с таким email уже существует"
                         )
-            current_user[field] = value
+                    reindex_user_field(current_user, field, value)
+                else:
+                    current_user[field] = value
+        seq = save_user(current_user)
+    await state_backend.wait_durable_async(seq)
     
     return {"message": "Данные пользователя обновлены", "user": current_user}
 
@@ -313,13 +430,18 @@ async def change_password(
     """
     Смена пароля
     """
-    if not verify_password(old_password, current_user["hashed_password"]):
+    is_valid, _ = await verify_password(old_password, current_user["hashed_password"])
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Неверный текущий пароль"
         )
     
-    current_user["hashed_password"] = hash_password(new_password)
+    new_hash = await hash_password(new_password)
+    with auth_lock:
+        current_user["hashed_password"] = new_hash
+        seq = save_user(current_user)
+    await state_backend.wait_durable_async(seq)
     
     return {"message": "Пароль успешно изменен"}
 
@@ -348,9 +470,11 @@ async def get_all_users():
     """
     Получение списка всех пользователей (только для администраторов)
     """
+    with auth_lock:
+        users = list(users_storage.values())
     return {
-        "total_users": len(users_storage),
-        "users": list(users_storage.values())
+        "total_users": len(users),
+        "users": users
     }
 
 @router.post("/admin/users/{user_id}/deactivate", dependencies=[Depends(get_current_active_user)])
@@ -364,5 +488,51 @@ async def deactivate_user(user_id: str):
             detail="Пользователь не найден"
         )
     
-    users_storage[user_id]["is_active"] = False
-    return {"message": "Пользователь деактивирован"}
\ No newline at end of file
+    with auth_lock:
+        users_storage[user_id]["is_active"] = False
+        seq = save_user(users_storage[user_id])
+    await state_backend.wait_durable_async(seq)
+    return {"message": "Пользователь деактивирован"}
+
+def export_state() -> Dict[str, Any]:
+    """Копия пользователей и refresh токенов для снимка журнала"""
+    with auth_lock:
+        return {
+            "users": [dict(user) for user in users_storage.values()],
+            "refresh_tokens": dict(refresh_tokens_storage)
+        }
+
+def _restore_user(user: Dict[str, Any]):
+    old_user = users_storage.get(user["id"])
+    if old_user is not None:
+        for field, index in user_indexes.items():
+            if index.get(old_user[field]) == user["id"]:
+                del index[old_user[field]]
+    users_storage[user["id"]] = user
+    index_user(user)
+
+def restore_state(state: Dict[str, Any]):
+    """Загрузка пользователей и refresh токенов из снимка (текущее состояние заменяется)"""
+    with auth_lock:
+        users_storage.clear()
+        for index in user_indexes.values():
+            index.clear()
+        refresh_tokens_storage.clear()
+        refresh_tokens_expiry.clear()
+        for user in state["users"]:
+            _restore_user(user)
+        for refresh_token, token_data in state["refresh_tokens"].items():
+            _put_refresh_token(refresh_token, token_data)
+
+def apply_record(record: Dict[str, Any]):
+    """Применение записи журнала"""
+    op = record["op"]
+    with auth_lock:
+        if op == "user":
+            _restore_user(record["user"])
+        elif op == "refresh_token":
+            _put_refresh_token(record["token"], record["data"])
+        elif op == "refresh_token_revoked":
+            refresh_tokens_storage.pop(record["token"], None)
+
+state_backend.register("auth", export_state, restore_state, apply_record)
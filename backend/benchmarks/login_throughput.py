@@ -0,0 +1,93 @@
+"""
+Пропускная способность /auth/login при параллельных запросах.
+
+Запуск из каталога backend:
+    python benchmarks/login_throughput.py --requests 200 --concurrency 1 8 32
+
+Для каждого уровня параллельности выводит число входов в секунду и
+максимальную задержку event loop: пока хеш считается в пуле потоков,
+остальные запросы продолжают обрабатываться
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Временные БД, журнал и каталог загрузок, чтобы не трогать рабочие данные
+WORK_DIR = tempfile.mkdtemp(prefix="login-bench-")
+os.chdir(WORK_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{WORK_DIR}/bench.db")
+os.environ.setdefault("JOURNAL_DIR", f"{WORK_DIR}/data")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from passwords import PASSWORD_HASH_ITERATIONS, PASSWORD_HASH_WORKERS  # noqa: E402
+
+LOGIN = "bench@example.com"
+PASSWORD = "bench-password"
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Максимальное опоздание пробуждения задачи - насколько блокировался event loop"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run_level(client: httpx.AsyncClient, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def login():
+        nonlocal failures
+        async with semaphore:
+            response = await client.post("/auth/login", json={"username": LOGIN, "password": PASSWORD})
+            if response.status_code != 200:
+                failures += 1
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lag = await lag_task
+    print(f"{concurrency:>11} {requests / elapsed:>10.1f} {elapsed / requests * 1000:>13.1f} "
+          f"{lag * 1000:>12.1f} {failures:>8}")
+
+
+async def run(requests: int, levels):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post("/auth/register", json={
+            "name": "Bench", "role": "user", "password": PASSWORD, "login": LOGIN
+        })
+        response.raise_for_status()
+
+        print(f"PBKDF2: {PASSWORD_HASH_ITERATIONS} итераций, потоков хеширования: {PASSWORD_HASH_WORKERS}")
+        print(f"{'параллельно':>11} {'входов/с':>10} {'мс на вход':>13} {'лаг loop, мс':>12} {'ошибок':>8}")
+        for concurrency in levels:
+            await run_level(client, requests, concurrency)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Входов на каждый уровень параллельности")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                        help="Уровни параллельности")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(run(args.requests, args.concurrency))
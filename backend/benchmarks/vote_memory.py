@@ -0,0 +1,86 @@
+"""
+Память на хранение голосов: прежняя раскладка
+{location_id: {user_id: {"rating": int, "timestamp": isoformat}}} против VoteStore
+(номера пользователей и столбцы array на локацию).
+
+Запуск из каталога backend:
+    python benchmarks/vote_memory.py --votes 1000000 --locations 1000
+
+Строки user_id создаются до замера и в обоих вариантах хранятся по одному
+экземпляру (их держат сессии), поэтому в результат не входят. Время голоса
+в прежней раскладке - отдельная строка на каждый голос, как в старом коде
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vote_store import VoteStore  # noqa: E402
+
+
+def generate_votes(count: int, locations: int, users: int, seed: int = 1):
+    """Голоса (location_id, user_id, rating, секунды) за последний год"""
+    generator = random.Random(seed)
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    now = int(time.time())
+    return [
+        (generator.randrange(locations), user_ids[generator.randrange(users)],
+         generator.randint(1, 5), now - generator.randrange(365 * 24 * 3600))
+        for _ in range(count)
+    ]
+
+
+def dict_layout(votes):
+    storage = {}
+    for location_id, user_id, rating, seconds in votes:
+        storage.setdefault(location_id, {})[user_id] = {
+            "rating": rating,
+            "timestamp": (datetime(1970, 1, 1) + timedelta(seconds=seconds)).isoformat()
+        }
+    return storage, sum(len(location_votes) for location_votes in storage.values())
+
+
+def columnar_layout(votes):
+    storage = VoteStore()
+    for location_id, user_id, rating, seconds in votes:
+        storage.set(location_id, user_id, rating, seconds)
+    return storage, len(storage)
+
+
+def measure(build, votes):
+    """Память, которую занимает построенное хранилище, и время построения"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    storage, stored = build(votes)
+    elapsed = time.perf_counter() - started
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del storage
+    gc.collect()
+    return stored, used, elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--votes", type=int, default=1000000, help="Сколько голосов сгенерировать")
+    parser.add_argument("--locations", type=int, default=1000, help="Число локаций")
+    parser.add_argument("--users", type=int, default=None, help="Число пользователей (по умолчанию votes / 5)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    votes = generate_votes(args.votes, args.locations, args.users or max(args.votes // 5, 1))
+
+    print(f"{'раскладка':<10} {'голосов':>10} {'МБ':>9} {'байт/голос':>11} {'построение, с':>14}")
+    for name, build in (("dict", dict_layout), ("VoteStore", columnar_layout)):
+        stored, used, elapsed = measure(build, votes)
+        print(f"{name:<10} {stored:>10} {used / 1e6:>9.1f} {used / stored:>11.0f} {elapsed:>14.2f}")
@@ -0,0 +1,85 @@
+import os
+import time
+from sqlalchemy import Column, Integer, Float, String, Text, create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, DeclarativeBase
+
+# По умолчанию используем локальный файл SQLite
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./tourist_app.db")
+
+engine_options = {"pool_pre_ping": True}
+if DATABASE_URL.startswith("sqlite"):
+    # Соединения из пула используются разными потоками threadpool'а FastAPI
+    engine_options["connect_args"] = {"check_same_thread": False}
+if DATABASE_URL != "sqlite://" and ":memory:" not in DATABASE_URL:
+    engine_options["pool_size"] = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+    engine_options["max_overflow"] = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+
+engine = create_engine(DATABASE_URL, **engine_options)
+
+if DATABASE_URL.startswith("sqlite") and engine_options.get("pool_size"):
+    @event.listens_for(engine, "connect")
+    def _enable_wal(dbapi_connection, connection_record):
+        # WAL: несколько воркеров читают, пока один пишет
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+class Base(DeclarativeBase): 
+    pass
+
+class Location(Base):
+    __tablename__ = "locations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(200), index=True)
+    description = Column(Text)
+    addres = Column(String(200), nullable=False, index=True)
+    coords = Column(String(200))
+    photo = Column(String(200))
+    workTime = Column(String(200))
+    contacts = Column(Text)
+    # Вычисляются из coords при записи, нужны для поиска на карте
+    lat = Column(Float, index=True)
+    lon = Column(Float)
+    geo_cell = Column(Integer, index=True)
+
+class LocationNgram(Base):
+    """Инвертированный индекс для поиска: n-грамма -> локации, где она встречается"""
+    __tablename__ = "location_ngrams"
+
+    field = Column(String(20), primary_key=True)
+    gram = Column(String(3), primary_key=True)
+    location_id = Column(Integer, primary_key=True, index=True)
+
+
+def _add_missing_columns():
+    """Добавление колонок, появившихся в моделях после создания таблиц"""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def init_db(attempts: int = 5):
+    """Создание таблиц, если их еще нет"""
+    for attempt in range(attempts):
+        try:
+            Base.metadata.create_all(bind=engine)
+            _add_missing_columns()
+            return
+        except OperationalError:
+            # Несколько воркеров запускаются одновременно и создают таблицы наперегонки
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
@@ -0,0 +1,33 @@
+import json
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен - используем стандартный json
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Сериализация в JSON (bytes)"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_array(fragments: Iterable[bytes]) -> bytes:
+    """Склейка уже сериализованных элементов в JSON-массив"""
+    return b"[" + b",".join(fragments) + b"]"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, который сериализует через orjson, если он доступен"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(Response):
+    """Ответ из заранее сериализованных байт JSON"""
+    media_type = "application/json"
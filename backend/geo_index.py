@@ -0,0 +1,95 @@
+import math
+import re
+from typing import Any, Optional, Tuple
+from sqlalchemy import and_, or_
+
+from database import Location
+
+# Размер ячейки сетки в градусах (~1 км по широте)
+CELL_SIZE = 0.01
+CELL_COLUMNS = int(360 / CELL_SIZE) + 1
+# Если bbox покрывает больше строк сетки, ищем по диапазону широты (индекс по lat)
+MAX_CELL_ROWS = 64
+EARTH_RADIUS_METERS = 6371000
+# geo_cell локации, координаты которой не удалось разобрать: ни в одну ячейку не попадает,
+# но отличается от NULL у строк, которые еще не обрабатывались
+NO_GEO_CELL = -1
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse_coords(coords: Any) -> Optional[Tuple[float, float]]:
+    """Разбор координат: [lat, lon] или строка вида "lat, lon" """
+    if isinstance(coords, (list, tuple)):
+        values = coords
+    elif isinstance(coords, str):
+        values = _NUMBER_RE.findall(coords)
+    else:
+        return None
+    if len(values) != 2:
+        return None
+    try:
+        lat, lon = float(values[0]), float(values[1])
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def _cell_row(lat: float) -> int:
+    return int((lat + 90) // CELL_SIZE)
+
+
+def _cell_column(lon: float) -> int:
+    return int((lon + 180) // CELL_SIZE)
+
+
+def cell_of(lat: float, lon: float) -> int:
+    """Номер ячейки сетки для точки"""
+    return _cell_row(lat) * CELL_COLUMNS + _cell_column(lon)
+
+
+def geo_fields(coords: Any) -> dict:
+    """Числовые колонки локации, вычисленные из coords"""
+    point = parse_coords(coords)
+    if point is None:
+        return {"lat": None, "lon": None, "geo_cell": NO_GEO_CELL}
+    lat, lon = point
+    return {"lat": lat, "lon": lon, "geo_cell": cell_of(lat, lon)}
+
+
+def bbox_clause(min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+    """Условие выборки локаций внутри прямоугольника"""
+    lon_range = Location.lon.between(min_lon, max_lon)
+    first_row, last_row = _cell_row(min_lat), _cell_row(max_lat)
+    if last_row - first_row + 1 > MAX_CELL_ROWS:
+        return and_(Location.lat.between(min_lat, max_lat), lon_range)
+    first_column, last_column = _cell_column(min_lon), _cell_column(max_lon)
+    # Каждая строка сетки - непрерывный диапазон номеров ячеек
+    cells = or_(*(
+        Location.geo_cell.between(row * CELL_COLUMNS + first_column, row * CELL_COLUMNS + last_column)
+        for row in range(first_row, last_row + 1)
+    ))
+    # lat + 0 - чтобы SQLite выбрал индекс geo_cell, а не диапазон по lat на всю ширину карты
+    return and_(cells, (Location.lat + 0).between(min_lat, max_lat), lon_range)
+
+
+def radius_bbox(lat: float, lon: float, radius: float) -> Tuple[float, float, float, float]:
+    """Прямоугольник, описанный вокруг окружности радиуса radius (в метрах)"""
+    delta_lat = math.degrees(radius / EARTH_RADIUS_METERS)
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    delta_lon = min(math.degrees(radius / (EARTH_RADIUS_METERS * cos_lat)), 180)
+    return (
+        max(lat - delta_lat, -90), max(lon - delta_lon, -180),
+        min(lat + delta_lat, 90), min(lon + delta_lon, 180)
+    )
+
+
+def distance_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между точками по формуле гаверсинусов"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
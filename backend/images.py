@@ -0,0 +1,66 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен - отдаем только оригиналы
+    Image = None
+
+# Размеры уменьшенных копий: {название: максимальная сторона в пикселях}
+IMAGE_SIZES = {
+    "thumb": 320,
+    "medium": 1024
+}
+WEBP_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def derivative_path(original: Path, size: str) -> Path:
+    """Путь к уменьшенной копии: <имя>.<size>.webp рядом с оригиналом"""
+    return original.with_name(f"{original.stem}.{size}.webp")
+
+
+def make_derivatives(original: Path):
+    """Создание уменьшенных копий в формате WebP (выполняется в отдельном процессе)"""
+    with Image.open(original) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for size, max_side in IMAGE_SIZES.items():
+            target = derivative_path(original, size)
+            if target.exists():
+                continue
+            copy = image.copy()
+            copy.thumbnail((max_side, max_side))
+            temp = target.with_name("." + target.name + ".tmp")
+            copy.save(temp, "WEBP", quality=WEBP_QUALITY)
+            os.replace(temp, target)
+
+
+async def process_upload(original: Path):
+    """Фоновая обработка загруженного фото"""
+    global _executor
+    if Image is None:
+        return
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(_executor, make_derivatives, original)
+    except Exception as e:
+        # Не картинка или поврежденный файл - останется только оригинал
+        print(f"Не удалось обработать изображение {original.name}: {e}")
+
+
+def shutdown_image_workers():
+    """Остановка пула процессов обработки изображений"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Каталог для журнала и снимков
+JOURNAL_DIR = Path(os.getenv("JOURNAL_DIR", "data"))
+# Дополнительная пауза перед записью пачки, чтобы собрать больше изменений в
+# один fsync. При 0 пачка - все, что накопилось, пока шел предыдущий fsync
+JOURNAL_FLUSH_INTERVAL_SECONDS = float(os.getenv("JOURNAL_FLUSH_INTERVAL_SECONDS", "0"))
+
+SNAPSHOT_FILE = "snapshot.json"
+
+logger = logging.getLogger(__name__)
+
+
+class JournalError(RuntimeError):
+    """Запись журнала на диск не удалась, изменения больше не принимаются"""
+
+
+class StateBackend(ABC):
+    """
+    Хранилище состояния, которое роутеры держат в памяти (голоса, сессии,
+    пользователи, токены). Роутер подключает свое хранилище через register()
+    и сообщает о каждом изменении через append(); бэкенд отвечает за
+    сохранность изменений и за загрузку состояния при запуске.
+
+    Записи должны полностью задавать новое значение ключа (а не приращение),
+    тогда повторное применение записи безопасно
+    """
+
+    def __init__(self):
+        self._stores: Dict[str, Dict[str, Optional[Callable]]] = {}
+
+    def register(self, name: str, export_state: Optional[Callable[[], Any]],
+                 restore_state: Optional[Callable[[Any], None]], apply_record: Callable[[Dict[str, Any]], None]):
+        """
+        Подключение хранилища:
+        export_state - копия состояния для снимка (должна сериализоваться в JSON),
+        restore_state - загрузка состояния из снимка (заменяет текущее состояние),
+        apply_record - применение одной записи.
+        Хранилище без export_state/restore_state только получает уведомления от broadcast()
+        """
+        self._stores[name] = {
+            "export": export_state,
+            "restore": restore_state,
+            "apply": apply_record
+        }
+
+    def _export(self) -> Dict[str, Any]:
+        return {name: store["export"]() for name, store in self._stores.items() if store["export"]}
+
+    def _restore(self, states: Dict[str, Any]):
+        for name, state in states.items():
+            store = self._stores.get(name)
+            if store is not None and store["restore"]:
+                store["restore"](state)
+
+    @abstractmethod
+    def append(self, store: str, record: Dict[str, Any]) -> int:
+        """
+        Записать изменение хранилища. Возвращает номер изменения для
+        wait_durable() (0 - ждать нечего)
+        """
+
+    def wait_durable(self, seq: int):
+        """
+        Дождаться, пока изменение с номером seq (и все до него) сохранено.
+        Блокирующий вызов, не из event loop
+        """
+
+    async def wait_durable_async(self, seq: int):
+        """wait_durable() для event loop"""
+        if seq:
+            await asyncio.to_thread(self.wait_durable, seq)
+
+    def broadcast(self, store: str, record: Dict[str, Any]):
+        """
+        Уведомить остальные процессы об изменении данных, которые лежат не в
+        памяти, а в общей БД (например, чтобы сбросить кеши). В одном процессе не нужно
+        """
+
+    def start(self):
+        """Загрузка состояния при запуске"""
+
+    def sync(self):
+        """Применить изменения, сделанные другими процессами (блокирующий вызов, не из event loop)"""
+
+    async def take_snapshot(self):
+        """Сохранить полное состояние, чтобы не хранить журнал изменений целиком"""
+
+    def close(self):
+        """Дописать изменения и освободить ресурсы"""
+
+
+class Journal(StateBackend):
+    """
+    Журнал изменений (write-ahead log) для хранилищ в памяти одного процесса.
+
+    Каждое изменение - одна JSON-строка с порядковым номером seq. Записи
+    накапливаются и сбрасываются на диск фоновым потоком пачками, с одним
+    fsync на пачку (group commit): append() только ставит запись в очередь,
+    а изменение сохранено, когда wait_durable() с ее номером вернул управление.
+    Если запись на диск не удалась, ошибка пишется в лог, и дальше append()
+    и wait_durable() бросают JournalError. Снимок сохраняет полное состояние и номер последней
+    вошедшей в него записи, после чего старые части журнала удаляются.
+    При запуске загружается снимок и применяются записи после него
+    """
+
+    def __init__(self, directory: Path, flush_interval: float):
+        super().__init__()
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._seq = 0
+        self._durable_seq = 0
+        self._error: Optional[BaseException] = None
+        self._pending: List[Any] = []
+        lock = threading.Lock()
+        # Новые записи для фонового потока
+        self._condition = threading.Condition(lock)
+        # Пачка записана на диск (или запись не удалась)
+        self._flushed = threading.Condition(lock)
+        self._writer: Optional[threading.Thread] = None
+        self._file = None
+        self._closing = False
+
+    def append(self, store: str, record: Dict[str, Any]) -> int:
+        """Добавить запись об изменении (не ждет записи на диск, см. wait_durable)"""
+        with self._condition:
+            self._check_error()
+            if self._writer is None:
+                # Журнал еще не запущен (или идет восстановление) - писать некуда
+                return 0
+            self._seq += 1
+            self._pending.append({"seq": self._seq, "store": store, **record})
+            self._condition.notify()
+            return self._seq
+
+    def wait_durable(self, seq: int):
+        """Дождаться fsync пачки, в которую попала запись seq"""
+        if not seq:
+            return
+        with self._flushed:
+            while self._durable_seq < seq and self._error is None:
+                self._flushed.wait()
+            if self._durable_seq < seq:
+                self._check_error()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise JournalError("Журнал не записывается на диск") from self._error
+
+    def _segment_path(self, first_seq: int) -> Path:
+        return self.directory / f"journal-{first_seq:012d}.log"
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.directory.glob("journal-*.log"))
+
+    def start(self):
+        """Восстановление состояния (снимок + журнал) и запуск фоновой записи"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        snapshot_path = self.directory / SNAPSHOT_FILE
+        if snapshot_path.exists():
+            with open(snapshot_path, "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+            self._seq = snapshot["seq"]
+            self._restore(snapshot["stores"])
+
+        for segment in self._segments():
+            self._replay_segment(segment)
+        self._durable_seq = self._seq
+
+        self._file = open(self._segment_path(self._seq + 1), "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def _replay_segment(self, segment: Path):
+        with open(segment, "rb+") as file:
+            # Конец последней целой строки
+            end = 0
+            torn = False
+            for line in file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("строка без перевода строки")
+                    record = json.loads(line)
+                except ValueError:
+                    torn = True
+                    break
+                end += len(line)
+                if record["seq"] <= self._seq:
+                    continue
+                self._seq = record["seq"]
+                store = self._stores.get(record["store"])
+                if store is not None:
+                    store["apply"](record)
+            if torn:
+                # Недописанная строка после сбоя: обрезаем ее, иначе новые записи,
+                # дописанные в эту часть журнала, при следующем запуске не прочитаются
+                logger.warning("Журнал %s обрезан до %d байт после недописанной строки", segment, end)
+                file.truncate(end)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+            if self.flush_interval and not self._closing:
+                # Даем накопиться пачке изменений, чтобы записать их одним fsync
+                time.sleep(self.flush_interval)
+            with self._condition:
+                batch, self._pending = self._pending, []
+            try:
+                self._write_batch(batch)
+            except Exception as error:
+                logger.exception("Ошибка записи журнала, изменения больше не принимаются")
+                with self._condition:
+                    self._error = error
+                    # Снимок, ждущий смены части журнала, тоже не должен зависнуть
+                    for item in batch + self._pending:
+                        if isinstance(item, _Rotate):
+                            item.done.set()
+                    self._pending = []
+                    self._flushed.notify_all()
+                return
+            records = [item for item in batch if not isinstance(item, _Rotate)]
+            if records:
+                with self._condition:
+                    self._durable_seq = records[-1]["seq"]
+                    self._flushed.notify_all()
+
+    def _write_batch(self, batch: List[Any]):
+        for item in batch:
+            if isinstance(item, _Rotate):
+                self._sync_file()
+                self._file.close()
+                self._file = open(self._segment_path(item.first_seq), "a", encoding="utf-8")
+                item.done.set()
+            else:
+                self._file.write(json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._sync_file()
+
+    def _sync_file(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def export_states(self) -> Optional[Dict[str, Any]]:
+        """
+        Номер последней записи и состояние всех хранилищ для снимка.
+        Вызывается из того потока, в котором хранилища изменяются (event loop)
+        """
+        with self._condition:
+            self._check_error()
+            if self._writer is None:
+                return None
+            seq = self._seq
+            rotate = _Rotate(seq + 1)
+            self._pending.append(rotate)
+            self._condition.notify()
+        states = self._export()
+        return {"seq": seq, "stores": states, "rotate": rotate}
+
+    def write_snapshot(self, exported: Dict[str, Any]):
+        """Запись снимка на диск и удаление частей журнала, которые в него вошли"""
+        rotate = exported.pop("rotate")
+        rotate.done.wait()
+        with self._condition:
+            self._check_error()
+
+        snapshot_path = self.directory / SNAPSHOT_FILE
+        temp_path = snapshot_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(exported, file, ensure_ascii=False, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, snapshot_path)
+
+        current = self._segment_path(rotate.first_seq)
+        for segment in self._segments():
+            if segment < current:
+                segment.unlink()
+
+    async def take_snapshot(self):
+        """Снимок состояния: копия данных в event loop, запись на диск - в отдельном потоке"""
+        exported = self.export_states()
+        if exported is not None:
+            await asyncio.to_thread(self.write_snapshot, exported)
+
+    def close(self):
+        """Дописать все изменения и остановить фоновую запись"""
+        if self._writer is None:
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._writer.join()
+        self._file.close()
+        self._writer = None
+
+
+class _Rotate:
+    """Служебная запись в очереди: начать новую часть журнала"""
+
+    def __init__(self, first_seq: int):
+        self.first_seq = first_seq
+        self.done = threading.Event()
@@ -0,0 +1,49 @@
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+
+class Leaderboard:
+    """
+    Рейтинг локаций, отсортированный по убыванию (score, votes).
+    Ключи хранятся в отсортированном списке, поэтому топ-N читается за O(N),
+    а обновление одной локации - бинарный поиск и сдвиг в списке.
+    Методы можно вызывать из разных потоков
+    """
+
+    def __init__(self):
+        self._entries: List[Tuple[float, int, int]] = []
+        self._keys: Dict[int, Tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def update(self, location_id: int, score: float, votes: int):
+        """Обновить позицию локации"""
+        key = (-score, -votes, location_id)
+        with self._lock:
+            self._remove(location_id)
+            self._keys[location_id] = key
+            insort(self._entries, key)
+
+    def remove(self, location_id: int):
+        """Убрать локацию из рейтинга"""
+        with self._lock:
+            self._remove(location_id)
+
+    def _remove(self, location_id: int):
+        key = self._keys.pop(location_id, None)
+        if key is not None:
+            del self._entries[bisect_left(self._entries, key)]
+
+    def clear(self):
+        """Очистить рейтинг"""
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def top(self, limit: int) -> List[int]:
+        """ID первых limit локаций"""
+        with self._lock:
+            return [location_id for _, _, location_id in self._entries[:max(limit, 0)]]
@@ -0,0 +1,389 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Iterator, Tuple, Set
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, Location
+from search_index import index_location, index_new_locations, unindex_location, search_rows
+from geo_index import geo_fields, bbox_clause, radius_bbox, distance_meters
+from fast_json import dumps
+from response_cache import bump_version
+from state_backend import state_backend
+
+# Сколько строк за раз читаем из БД при обходе всех локаций
+PAGE_SIZE = 500
+
+
+# ID локации хранится в INTEGER SQLite (64 бита со знаком)
+MIN_LOCATION_ID = -2 ** 63
+MAX_LOCATION_ID = 2 ** 63 - 1
+
+# Поля локации в том порядке, в котором они отдаются клиенту
+LOCATION_FIELDS = ["id", "name", "description", "addres", "coords", "photo", "workTime", "contacts"]
+# Поля, которые хранятся в БД в виде JSON
+JSON_FIELDS = ("contacts", "coords")
+
+# Кеш сериализованных в JSON локаций: {location_id: bytes}
+FRAGMENT_CACHE_SIZE = 10000
+_fragment_cache: "OrderedDict[int, bytes]" = OrderedDict()
+_fragment_lock = threading.Lock()
+# Увеличивается при каждом изменении локаций: фрагмент, прочитанный из БД
+# до изменения, в кеш уже не попадет
+_fragment_generation = 0
+
+
+def location_to_dict(row, fields: List[str] = LOCATION_FIELDS) -> Dict[str, Any]:
+    """Преобразование строки БД в словарь локации (только поля из fields)"""
+    location = {}
+    for field in fields:
+        value = getattr(row, field)
+        if field == "contacts":
+            value = _decode_json(value) if value else {}
+        elif field == "coords":
+            value = _decode_json(value)
+        elif field == "photo":
+            value = value or ""
+        location[field] = value
+    return location
+
+
+def _decode_json(value: Optional[str]) -> Any:
+    """Чтение поля, сохраненного в JSON (старые записи могут быть обычной строкой)"""
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _apply_fields(row: Location, fields: Dict[str, Any]):
+    """Перенос полей словаря в строку БД"""
+    for field, value in fields.items():
+        if field in JSON_FIELDS:
+            value = json.dumps(value, ensure_ascii=False)
+        setattr(row, field, value)
+    if "coords" in fields:
+        for field, value in geo_fields(fields["coords"]).items():
+            setattr(row, field, value)
+
+
+def is_valid_location_id(value: Any) -> bool:
+    """Целое число, которое помещается в колонку ID"""
+    return isinstance(value, int) and MIN_LOCATION_ID <= value <= MAX_LOCATION_ID
+
+
+def find_location(location_id: int) -> Optional[Dict[str, Any]]:
+    """Поиск локации по ID"""
+    if not is_valid_location_id(location_id):
+        return None
+    with SessionLocal() as session:
+        row = session.get(Location, location_id)
+        return location_to_dict(row) if row is not None else None
+
+
+def _remember_fragment(location_id: int, fragment: bytes, generation: int):
+    with _fragment_lock:
+        if generation != _fragment_generation:
+            return
+        _fragment_cache[location_id] = fragment
+        _fragment_cache.move_to_end(location_id)
+        while len(_fragment_cache) > FRAGMENT_CACHE_SIZE:
+            _fragment_cache.popitem(last=False)
+
+
+def _cached_fragment(location_id: int) -> Optional[bytes]:
+    with _fragment_lock:
+        fragment = _fragment_cache.get(location_id)
+        if fragment is not None:
+            _fragment_cache.move_to_end(location_id)
+        return fragment
+
+
+def invalidate_fragment(location_id: int):
+    """Сброс закешированного JSON локации после ее изменения"""
+    global _fragment_generation
+    with _fragment_lock:
+        _fragment_generation += 1
+        _fragment_cache.pop(location_id, None)
+
+
+def _locations_changed(location_ids: List[int]):
+    """Сброс кешей после изменения локаций и уведомление остальных воркеров"""
+    for location_id in location_ids:
+        invalidate_fragment(location_id)
+    bump_version("locations")
+    state_backend.broadcast("locations", {"ids": location_ids})
+
+
+def _apply_locations_record(record: Dict[str, Any]):
+    """Локации изменил другой воркер: сами данные уже в общей БД, сбрасываем кеши"""
+    for location_id in record["ids"]:
+        invalidate_fragment(location_id)
+    bump_version("locations")
+
+
+state_backend.register("locations", None, None, _apply_locations_record)
+
+
+def get_location_fragment(location_id: int) -> Optional[bytes]:
+    """Локация, сериализованная в JSON"""
+    fragment = _cached_fragment(location_id)
+    if fragment is None:
+        generation = _fragment_generation
+        location = find_location(location_id)
+        if location is None:
+            return None
+        fragment = dumps(location)
+        _remember_fragment(location_id, fragment, generation)
+    return fragment
+
+
+def get_location_fragments_page(after_id: Optional[int] = None,
+                                limit: int = PAGE_SIZE) -> Tuple[List[bytes], Optional[int]]:
+    """
+    Страница локаций в виде готовых JSON-фрагментов.
+    Из БД читаются только ID страницы и строки, которых нет в кеше
+    """
+    query = select(Location.id).order_by(Location.id).limit(limit)
+    if after_id is not None:
+        query = query.where(Location.id > after_id)
+    generation = _fragment_generation
+    with SessionLocal() as session:
+        ids = session.scalars(query).all()
+        fragments = {}
+        missing = []
+        for location_id in ids:
+            fragment = _cached_fragment(location_id)
+            if fragment is None:
+                missing.append(location_id)
+            else:
+                fragments[location_id] = fragment
+        if missing:
+            for row in session.scalars(select(Location).where(Location.id.in_(missing))):
+                fragment = fragments[row.id] = dumps(location_to_dict(row))
+                _remember_fragment(row.id, fragment, generation)
+    next_after_id = ids[-1] if len(ids) == limit else None
+    # Локация могла быть удалена между запросами
+    return [fragments[location_id] for location_id in ids if location_id in fragments], next_after_id
+
+
+def iter_location_fragments(page_size: int = PAGE_SIZE) -> Iterator[bytes]:
+    """Постраничный обход всех локаций в виде JSON-фрагментов"""
+    after_id = None
+    while True:
+        page, after_id = get_location_fragments_page(after_id, page_size)
+        yield from page
+        if after_id is None:
+            return
+
+
+def get_locations_page(after_id: Optional[int] = None, limit: int = PAGE_SIZE,
+                       fields: List[str] = LOCATION_FIELDS) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Страница локаций в порядке ID, начиная после after_id.
+    Из БД читаются только запрошенные поля.
+    Возвращает локации и курсор следующей страницы (None, если это последняя)
+    """
+    columns = [getattr(Location, field) for field in fields]
+    if "id" not in fields:
+        columns.append(Location.id)
+    query = select(*columns).order_by(Location.id).limit(limit)
+    if after_id is not None:
+        query = query.where(Location.id > after_id)
+    with SessionLocal() as session:
+        rows = session.execute(query).all()
+    next_after_id = rows[-1].id if len(rows) == limit else None
+    return [location_to_dict(row, fields) for row in rows], next_after_id
+
+
+def iter_locations(fields: List[str] = LOCATION_FIELDS, page_size: int = PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Постраничный обход всех локаций в порядке ID"""
+    after_id = None
+    while True:
+        page, after_id = get_locations_page(after_id, page_size, fields)
+        yield from page
+        if after_id is None:
+            return
+
+
+def get_locations(fields: List[str] = LOCATION_FIELDS) -> List[Dict[str, Any]]:
+    """Все локации в порядке ID"""
+    return list(iter_locations(fields))
+
+
+def add_location(location: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавление новой локации. Если ID уже занят (в том числе параллельным запросом) - LookupError"""
+    with SessionLocal() as session:
+        row = Location()
+        _apply_fields(row, location)
+        session.add(row)
+        index_location(session, location["id"], location)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            raise LookupError(location["id"])
+    _locations_changed([location["id"]])
+    return location
+
+
+def add_locations(locations: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+    """
+    Добавление пачки локаций в одной транзакции.
+    Локации с уже занятыми (в том числе в этой же пачке) ID пропускаются.
+    Возвращает ID добавленных и ID пропущенных локаций
+    """
+    ids = [location["id"] for location in locations]
+    with SessionLocal() as session:
+        existing = set(session.scalars(select(Location.id).where(Location.id.in_(ids))))
+        added = []
+        skipped = []
+        for location in locations:
+            if location["id"] in existing:
+                skipped.append(location["id"])
+                continue
+            existing.add(location["id"])
+            row = Location()
+            _apply_fields(row, location)
+            session.add(row)
+            added.append(location)
+        index_new_locations(session, added)
+        try:
+            session.commit()
+        except IntegrityError:
+            # ID заняли параллельно с проверкой - повторяем, занятые пропустятся
+            session.rollback()
+            return add_locations(locations)
+    added_ids = [location["id"] for location in added]
+    if added_ids:
+        _locations_changed(added_ids)
+    return added_ids, skipped
+
+
+def existing_location_ids(ids: List[int]) -> Set[int]:
+    """Какие из переданных ID уже заняты (запросами по PAGE_SIZE ID)"""
+    existing = set()
+    with SessionLocal() as session:
+        for start in range(0, len(ids), PAGE_SIZE):
+            chunk = ids[start:start + PAGE_SIZE]
+            existing.update(session.scalars(select(Location.id).where(Location.id.in_(chunk))))
+    return existing
+
+
+def save_locations(created: List[Dict[str, Any]], updated: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Добавление и обновление пачки локаций в одной транзакции: либо применяется все, либо ничего.
+    Если за это время ID нового элемента заняли или обновляемую локацию удалили - LookupError
+    Возвращает обновленные локации
+    """
+    with SessionLocal() as session:
+        rows = {}
+        update_ids = list(updated)
+        for start in range(0, len(update_ids), PAGE_SIZE):
+            chunk = update_ids[start:start + PAGE_SIZE]
+            rows.update((row.id, row) for row in session.scalars(select(Location).where(Location.id.in_(chunk))))
+        if len(rows) != len(updated):
+            raise LookupError(sorted(set(updated) - set(rows)))
+        for location_id, fields in updated.items():
+            _apply_fields(rows[location_id], fields)
+            index_location(session, location_id, fields)
+        for location in created:
+            row = Location()
+            _apply_fields(row, location)
+            session.add(row)
+        index_new_locations(session, created)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            raise LookupError([location["id"] for location in created])
+        _locations_changed(list(updated) + [location["id"] for location in created])
+        return [location_to_dict(rows[location_id]) for location_id in updated]
+
+
+def update_location(location_id: int, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Обновление полей локации"""
+    if not is_valid_location_id(location_id):
+        return None
+    with SessionLocal() as session:
+        row = session.get(Location, location_id)
+        if row is None:
+            return None
+        _apply_fields(row, fields)
+        index_location(session, location_id, fields)
+        session.commit()
+        _locations_changed([location_id])
+        return location_to_dict(row)
+
+
+def remove_location(location_id: int) -> Optional[Dict[str, Any]]:
+    """Удаление локации"""
+    if not is_valid_location_id(location_id):
+        return None
+    with SessionLocal() as session:
+        row = session.get(Location, location_id)
+        if row is None:
+            return None
+        location = location_to_dict(row)
+        session.delete(row)
+        unindex_location(session, location_id)
+        session.commit()
+        _locations_changed([location_id])
+        return location
+
+
+def search_locations(filters: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+    """Поиск локаций по подстрокам в полях (через инвертированный индекс)"""
+    if not any(filters.values()):
+        return get_locations()
+    with SessionLocal() as session:
+        return [location_to_dict(row) for row in search_rows(session, filters)]
+
+
+def get_locations_in_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                          limit: int) -> List[Dict[str, Any]]:
+    """Локации внутри прямоугольника на карте (не больше limit, в порядке ID)"""
+    with SessionLocal() as session:
+        # Без ORDER BY: с сортировкой по id SQLite обходит всю таблицу вместо индекса geo_cell
+        query = select(Location).where(bbox_clause(min_lat, min_lon, max_lat, max_lon)).limit(limit)
+        rows = sorted(session.scalars(query), key=lambda row: row.id)
+        return [location_to_dict(row) for row in rows]
+
+
+def get_nearby_locations(lat: float, lon: float, radius: float, limit: int) -> List[Dict[str, Any]]:
+    """Локации в радиусе radius метров от точки, ближайшие первыми"""
+    with SessionLocal() as session:
+        # Расстояния считаем по одним координатам, полностью читаем только limit ближайших
+        query = select(Location.id, Location.lat, Location.lon).where(bbox_clause(*radius_bbox(lat, lon, radius)))
+        found = []
+        for location_id, location_lat, location_lon in session.execute(query):
+            distance = distance_meters(lat, lon, location_lat, location_lon)
+            if distance <= radius:
+                found.append((distance, location_id))
+        found.sort()
+        found = found[:limit]
+        rows = {row.id: row for row in session.scalars(
+            select(Location).where(Location.id.in_([location_id for _, location_id in found]))
+        )}
+    return [
+        {**location_to_dict(rows[location_id]), "distance": round(distance, 1)}
+        for distance, location_id in found if location_id in rows
+    ]
+
+
+def ensure_geo_index(session):
+    """
+    Заполнение координат для локаций, сохраненных до появления гео-индекса.
+    Обработанные строки получают geo_cell (NO_GEO_CELL, если координаты не разобрать),
+    поэтому при следующих запусках запрос по индексу geo_cell ничего не находит
+    """
+    rows = session.scalars(
+        select(Location).where(Location.geo_cell.is_(None), Location.coords.is_not(None))
+    ).all()
+    for row in rows:
+        for field, value in geo_fields(_decode_json(row.coords)).items():
+            setattr(row, field, value)
+    session.commit()
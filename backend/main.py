@@ -1,19 +1,32 @@
-from fastapi import FastAPI, status
+from fastapi import FastAPI, Request, status
 from utils import json_to_dict_list
 import os
 from typing import Optional
 from fastapi.responses import HTMLResponse
 import json
-from sqlalchemy import Column, Integer, String, Text, DateTime, create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from fastapi.responses import JSONResponse, FileResponse
+from database import Location, SessionLocal, init_db
+from search_index import ensure_search_index
+from fastapi.responses import JSONResponse
 from fastapi import File, UploadFile, Body
 from personal_routes import router as locations_router
-from voting_routes import router as voting_router
+from location_store import find_location, ensure_geo_index
+from voting_routes import router as voting_router, session_cleanup_loop, vote_queue, VOTE_QUEUE_ENABLED
 from fastapi.middleware.cors import CORSMiddleware
-from auth_routes import router as auth_router
-from pathlib import Path
-
+from auth_routes import router as auth_router, refresh_token_cleanup_loop
+from uploads import UPLOAD_DIR, UploadSizeLimitMiddleware, MAX_UPLOAD_BYTES, UPLOAD_FORM_OVERHEAD_BYTES
+from images import IMAGE_SIZES, derivative_path, shutdown_image_workers
+from static_files import serve_file
+from state_backend import state_backend, snapshot_loop, sync_loop, STATE_BACKEND
+from starlette.concurrency import run_in_threadpool
+import asyncio
+
+
+init_db()
+with SessionLocal() as session:
+    ensure_search_index(session)
+    ensure_geo_index(session)
+# Восстанавливаем голоса, сессии и пользователей из снимка и журнала
+state_backend.start()
 
 app = FastAPI(
     title="Tourist App API", 
@@ -21,19 +34,58 @@ app = FastAPI(
 )
 
 
+# Слишком большие загрузки отклоняются до того, как тело будет прочитано
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/locations/uploadfile"],
+    max_body_bytes=MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After-Id"],
 )
 
+if STATE_BACKEND == "sqlite":
+    @app.middleware("http")
+    async def sync_state(request: Request, call_next):
+        # При нескольких воркерах сначала применяем изменения, сделанные другими
+        await run_in_threadpool(state_backend.sync)
+        return await call_next(request)
+
 app.include_router(locations_router)
 app.include_router(voting_router)
 app.include_router(auth_router)
 
 
+@app.on_event("startup")
+async def start_background_tasks():
+    if VOTE_QUEUE_ENABLED:
+        vote_queue.start()
+    app.state.background_tasks = [
+        asyncio.create_task(session_cleanup_loop()),
+        asyncio.create_task(refresh_token_cleanup_loop()),
+        asyncio.create_task(snapshot_loop())
+    ]
+    if STATE_BACKEND == "sqlite":
+        app.state.background_tasks.append(asyncio.create_task(sync_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in app.state.background_tasks:
+        task.cancel()
+    shutdown_image_workers()
+    # Дописываем голоса из очереди до снимка состояния
+    vote_queue.close()
+    await state_backend.take_snapshot()
+    state_backend.close()
+
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "tourist_app_with_voting"}
@@ -44,31 +96,11 @@ def read_root():
     html_content = "<h2></h2>"
     return HTMLResponse(content=html_content)
 
-class Base(DeclarativeBase): 
-    pass
-
-class Location(Base):
-    __tablename__ = "locations"
-
-    id = Column(Integer, primary_key=True, index=True)
-    description = Column(Text)
-    addres = Column(String(200), nullable=False)
-    coords = Column(String(200))
-    photo = Column(String(200))
-    workTime = Column(String(200))
-    contacts = Column(String(200))
-
-objective_storage = []
-objective = []
-
 def find_problem(id):
-    for problem in objective_storage: 
-        if problem.id == id:
-            return problem
-    return None
+    return find_location(id)
 
 @app.get("/location/{id}")
-def get_problem(id):
+def get_problem(id: int):
    
     problem = find_problem(id)
     print(problem)
@@ -102,14 +134,26 @@ def create_location(data  = Body()):
         contacts = contacts
     )
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
 @app.get("/uploads/{filename}")
-async def get_file(filename: str):
+def get_file(request: Request, filename: str, size: str = "full"):
+    if size != "full" and size not in IMAGE_SIZES:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"error": f"Unknown size, expected one of: full, {', '.join(IMAGE_SIZES)}"}
+        )
     file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
-        return {"error": "File not found"}
-    return FileResponse(file_path)
+    response = None
+    if size in IMAGE_SIZES:
+        response = serve_file(request, derivative_path(file_path, size))
+    if response is None:
+        # Пока уменьшенной копии нет, оригинал по этому адресу надолго не кешируем
+        response = serve_file(request, file_path, cacheable=size == "full")
+    if response is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": "File not found"}
+        )
+    return response
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+# Стоимость хеширования (можно поднять через переменную окружения)
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "200000"))
+# Сколько хешей считаем параллельно
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+
+# hashlib отпускает GIL во время расчета, поэтому хватает пула потоков
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def hash_password_sync(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    """Хеширование пароля: pbkdf2_sha256$итерации$соль$хеш"""
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _pbkdf2(password, salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password_sync(password: str, hashed_password: str) -> Tuple[bool, bool]:
+    """
+    Проверка пароля.
+    Возвращает (пароль верный, хеш нужно пересчитать с текущими настройками)
+    """
+    if not hashed_password.startswith(ALGORITHM + "$"):
+        # Старый формат: sha256 без соли
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, hashed_password), True
+
+    try:
+        _, iterations, salt, digest = hashed_password.split("$")
+        iterations = int(iterations)
+        salt, digest = bytes.fromhex(salt), bytes.fromhex(digest)
+    except ValueError:
+        return False, False
+    is_valid = hmac.compare_digest(_pbkdf2(password, salt, iterations), digest)
+    return is_valid, is_valid and iterations != PASSWORD_HASH_ITERATIONS
+
+
+async def hash_password(password: str) -> str:
+    """Хеширование пароля в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, hash_password_sync, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, bool]:
+    """Проверка пароля в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, verify_password_sync, password, hashed_password)
@@ -1,13 +1,42 @@
-from fastapi import APIRouter, status, HTTPException, Form, File, UploadFile
+from fastapi import APIRouter, status, HTTPException, Form, File, UploadFile, Query, BackgroundTasks, Request
 from typing import List, Optional, Dict, Any
-from fastapi.responses import JSONResponse
+from collections import Counter
+from fastapi.responses import JSONResponse, StreamingResponse
 import json
-from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from location_store import find_location, get_locations, add_location, add_locations, existing_location_ids, save_locations, update_location as update_stored_location, remove_location, search_locations as search_stored_locations
+from uploads import save_upload, UPLOAD_DIR
+from images import process_upload
+from location_store import get_nearby_locations, get_locations_in_bbox, get_locations_page, LOCATION_FIELDS, is_valid_location_id
+from location_store import get_location_fragment, get_location_fragments_page, iter_location_fragments
+from fast_json import FastJSONResponse, RawJSONResponse, json_array
+from response_cache import versioned_response
+from utils import IncrementalJSONParser
 
-router = APIRouter(prefix="/locations", tags=["locations"])
+router = APIRouter(prefix="/locations", tags=["locations"], default_response_class=FastJSONResponse)
 
-# Временное хранилище для локаций (вместо БД)
-locations_storage = []
+# Размеры страниц для списка локаций
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Максимум точек, отдаваемых на карту за один запрос
+MAX_MAP_LOCATIONS = 5000
+# Максимальный радиус поиска рядом с точкой, метров
+MAX_NEARBY_RADIUS = 50000
+
+# Сколько локаций из импортируемого потока записывается в БД за одну транзакцию
+IMPORT_BATCH_SIZE = 500
+# Сколько ошибок импорта возвращается клиенту
+MAX_IMPORT_ERRORS = 100
+
+# Максимум локаций в одном пакетном запросе
+MAX_BATCH_SIZE = 10000
+
+# Поля, которые можно менять у существующей локации
+UPDATABLE_FIELDS = ["description", "addres", "coords", "photo", "workTime", "contacts"]
+
+# Текстовые поля локации, которые могут быть null (addres обязателен)
+TEXT_FIELDS = ["name", "description", "photo", "workTime"]
 
 # Модель локации в виде словаря для валидации
 LOCATION_MODEL = {
@@ -18,12 +47,15 @@ LOCATION_MODEL = {
     "contacts": dict
 }
 
-def find_location(location_id: int):
-    """Поиск локации по ID"""
-    for location in locations_storage:
-        if location["id"] == location_id:
-            return location
-    return None
+def validate_location_fields(data: dict) -> bool:
+    """Проверка типов переданных полей локации (при создании и при обновлении)"""
+    # Адрес хранится в NOT NULL колонке
+    if "addres" in data and not isinstance(data["addres"], str):
+        return False
+    for field in TEXT_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return False
+    return True
 
 def validate_location_data(data: dict) -> bool:
     """Валидация данных локации"""
@@ -35,55 +67,228 @@ def validate_location_data(data: dict) -> bool:
                 return False
         
         # Проверяем типы данных
-        if not isinstance(data["id"], int):
+        if not is_valid_location_id(data["id"]):
             return False
         if not isinstance(data["contacts"], dict):
             return False
             
-        return True
+        return validate_location_fields(data)
     except:
         return False
 
+def build_location(data: dict) -> dict:
+    """Локация из проверенных входных данных"""
+    return {
+        "id": data['id'],
+        "name": data.get('name', ''),
+        "description": data['description'],
+        "addres": data['addres'],
+        "coords": data['coords'],
+        "photo": data.get('photo', ''),
+        "workTime": data['workTime'],
+        "contacts": data['contacts']  # Уже должен быть словарем
+    }
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Разбор списка полей вида "id,name,photo" """
+    if not fields:
+        return LOCATION_FIELDS
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in LOCATION_FIELDS]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестные поля: {', '.join(unknown)}. Доступные поля: {', '.join(LOCATION_FIELDS)}"
+        )
+    # Порядок полей всегда как в LOCATION_FIELDS: ?fields=id,name и ?fields=name,id - один ответ
+    return [field for field in LOCATION_FIELDS if field in requested]
+
 @router.get("/", response_model=List[Dict[str, Any]])
-def get_all_locations():
+def get_all_locations(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+    fields: Optional[str] = Query(None, description="Поля через запятую, например id,name,photo")
+):
+    """
+    Получить все туристические локации.
+    С limit/after_id отдается одна страница, курсор следующей - в заголовке X-Next-After-Id
+    """
+    field_list = parse_fields(fields)
+    paginated = limit is not None or after_id is not None
+    
+    def build():
+        next_after_id = None
+        # Полные локации собираем из закешированных JSON-фрагментов
+        if field_list == LOCATION_FIELDS:
+            if paginated:
+                fragments, next_after_id = get_location_fragments_page(after_id, limit or DEFAULT_PAGE_SIZE)
+            else:
+                fragments = iter_location_fragments()
+            response = RawJSONResponse(json_array(fragments))
+        elif paginated:
+            page, next_after_id = get_locations_page(after_id, limit or DEFAULT_PAGE_SIZE, field_list)
+            response = FastJSONResponse(page)
+        else:
+            response = FastJSONResponse(get_locations(field_list))
+        
+        if next_after_id is not None:
+            response.headers["X-Next-After-Id"] = str(next_after_id)
+        return response
+    
+    return versioned_response(
+        request, ("locations",), ("locations", limit, after_id, tuple(field_list)), build
+    )
+
+@router.get("/nearby")
+def get_nearby_locations_route(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(1000, gt=0, le=MAX_NEARBY_RADIUS, description="Радиус в метрах"),
+    limit: int = Query(500, ge=1, le=MAX_MAP_LOCATIONS)
+):
+    """
+    Получить локации в радиусе от точки (ближайшие первыми)
     """
-    Получить все туристические локации
+    locations = get_nearby_locations(lat, lon, radius, limit)
+    return {
+        "found_count": len(locations),
+        "locations": locations
+    }
+
+@router.get("/in-bbox")
+def get_locations_in_bbox_route(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(500, ge=1, le=MAX_MAP_LOCATIONS)
+):
+    """
+    Получить локации, попадающие в видимую область карты
+    """
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректные границы области"
+        )
+    
+    locations = get_locations_in_bbox(min_lat, min_lon, max_lat, max_lon, limit)
+    return {
+        "found_count": len(locations),
+        "locations": locations
+    }
+
+@router.get("/export")
+def export_locations():
+    """
+    Выгрузить все локации в формате NDJSON (по локации на строку).
+    Локации читаются из БД постранично, поэтому память не растет с размером каталога
+    """
+    def lines():
+        for fragment in iter_location_fragments():
+            yield fragment + b"\n"
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="locations.ndjson"'}
+    )
+
+@router.post("/import")
+async def import_locations(request: Request):
     """
-    return locations_storage
+    Импорт локаций из тела запроса в формате NDJSON или JSON-массива.
+    Тело разбирается по мере получения и записывается в БД пачками,
+    некорректные локации и занятые ID пропускаются и попадают в список ошибок
+    """
+    parser = IncrementalJSONParser()
+    batch = []
+    imported = 0
+    errors = []
+    index = 0
+    
+    def add_error(item_index, location_id, message):
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({"index": item_index, "id": location_id, "error": message})
+    
+    async def flush():
+        nonlocal imported
+        if not batch:
+            return
+        added, _ = await run_in_threadpool(add_locations, [location for _, location in batch])
+        imported += len(added)
+        # add_locations сохраняет порядок, поэтому пропущенные находятся одним проходом
+        position = 0
+        for item_index, location in batch:
+            if position < len(added) and added[position] == location["id"]:
+                position += 1
+            else:
+                add_error(item_index, location["id"], "Локация с таким ID уже существует")
+        batch.clear()
+    
+    async def consume(items):
+        nonlocal index
+        for item in items:
+            if isinstance(item, dict) and validate_location_data(item):
+                batch.append((index, build_location(item)))
+            else:
+                add_error(index, item.get("id") if isinstance(item, dict) else None, "Некорректные данные локации")
+            index += 1
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush()
+    
+    try:
+        async for chunk in request.stream():
+            await consume(parser.feed(chunk))
+        await consume(parser.close())
+    except ValueError as e:
+        await flush()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Некорректный JSON после {index} локаций (импортировано {imported}): {e}"
+        )
+    await flush()
+    
+    return {
+        "message": "Импорт завершен",
+        "imported": imported,
+        "failed": index - imported,
+        "errors": sorted(errors, key=lambda error: error["index"])
+    }
 
 @router.get("/{location_id}")
 def get_location(location_id: int):
     """
     Получить конкретную туристическую локацию по ID
     """
-    location = find_location(location_id)
+    fragment = get_location_fragment(location_id)
     
-    if location is None:
+    if fragment is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Туристическая локация не найдена"
         )
     
-    return location
-
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+    return RawJSONResponse(fragment)
 
 @router.post("/uploadfile")
-async def create_upload_file(location_id: int = Form(...), file: UploadFile = File(...)):  
-    file_path = UPLOAD_DIR / file.filename
-
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
-
-    file_url = f"/uploads/{file.filename}"
+async def create_upload_file(background_tasks: BackgroundTasks, location_id: int = Form(...), file: UploadFile = File(...)):  
+    # Размер всего запроса ограничивает UploadSizeLimitMiddleware еще до разбора формы
+    if await run_in_threadpool(find_location, location_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Туристическая локация не найдена"
+        )
 
-    result = next((item for item in locations_storage if item["id"] == location_id), None)
+    filename = await save_upload(file)
+    file_url = f"/uploads/{filename}"
+    # Уменьшенные копии готовятся после ответа клиенту
+    background_tasks.add_task(process_upload, UPLOAD_DIR / filename)
 
-    result['photo'] = file_url
+    await run_in_threadpool(update_stored_location, location_id, {"photo": file_url})
 
-    return {"filename": file.filename, "url": file_url}
+    return {"filename": filename, "url": file_url}
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 def create_location(data: dict):
@@ -106,19 +311,16 @@ def create_location(data: dict):
         )
     
     # Создаем новую локацию
-    location = {
-        "id": data['id'],
-        "name": data['name'],
-        "description": data['description'],
-        "addres": data['addres'],
-        "coords": data['coords'],
-        "photo": data.get('photo', ''),
-        "workTime": data['workTime'],
-        "contacts": data['contacts']  # Уже должен быть словарем
-    }
+    location = build_location(data)
     
-    # Добавляем в хранилище
-    locations_storage.append(location)
+    # Добавляем в хранилище (ID мог занять параллельный запрос)
+    try:
+        add_location(location)
+    except LookupError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Локация с таким ID уже существует"
+        )
     
     return {
         "message": "Туристическая локация успешно создана",
@@ -126,6 +328,65 @@ def create_location(data: dict):
         "location": location
     }
 
+@router.post("/batch")
+def batch_save_locations(data: List[Any]):
+    """
+    Создать или обновить пачку локаций за один запрос.
+    Локации с новыми ID создаются (нужны все поля), с существующими - обновляются.
+    Изменения применяются целиком или не применяются вовсе; при ошибках
+    возвращается список проблемных элементов
+    """
+    if len(data) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Не больше {MAX_BATCH_SIZE} локаций за запрос"
+        )
+    
+    errors = []
+    ids = [item.get("id") if isinstance(item, dict) else None for item in data]
+    repeated = {location_id for location_id, count in Counter(
+        location_id for location_id in ids if is_valid_location_id(location_id)
+    ).items() if count > 1}
+    existing = existing_location_ids([location_id for location_id in ids if is_valid_location_id(location_id)])
+    
+    created = []
+    updated = {}
+    for index, item in enumerate(data):
+        location_id = ids[index]
+        if not is_valid_location_id(location_id):
+            errors.append({"index": index, "id": location_id, "error": "Некорректный ID локации"})
+        elif location_id in repeated:
+            errors.append({"index": index, "id": location_id, "error": "ID повторяется в запросе"})
+        elif location_id in existing:
+            if validate_location_fields(item):
+                updated[location_id] = {field: item[field] for field in UPDATABLE_FIELDS if field in item}
+            else:
+                errors.append({"index": index, "id": location_id, "error": "Некорректные данные локации"})
+        elif validate_location_data(item):
+            created.append(build_location(item))
+        else:
+            errors.append({"index": index, "id": location_id, "error": "Некорректные данные локации"})
+    
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Некорректные данные, изменения не применены", "errors": errors}
+        )
+    
+    try:
+        updated_locations = save_locations(created, updated)
+    except LookupError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Локации изменились во время сохранения, повторите запрос: {e.args[0]}"
+        )
+    
+    return {
+        "message": "Локации успешно сохранены",
+        "created": [location["id"] for location in created],
+        "updated": [location["id"] for location in updated_locations]
+    }
+
 @router.put("/{location_id}")
 def update_location(location_id: int, data: dict):
     """
@@ -139,19 +400,17 @@ def update_location(location_id: int, data: dict):
             detail="Туристическая локация не найдена"
         )
     
+    if not validate_location_fields(data):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректные данные локации"
+        )
+    
     # Обновляем поля локации
-    if 'description' in data:
-        location["description"] = data['description']
-    if 'addres' in data:
-        location["addres"] = data['addres']
-    if 'coords' in data:
-        location["coords"] = data['coords']
-    if 'photo' in data:
-        location["photo"] = data['photo']
-    if 'workTime' in data:
-        location["workTime"] = data['workTime']
-    if 'contacts' in data:
-        location["contacts"] = data['contacts']
+    location = update_stored_location(
+        location_id,
+        {field: data[field] for field in UPDATABLE_FIELDS if field in data}
+    )
     
     return {
         "message": "Туристическая локация успешно обновлена",
@@ -172,7 +431,7 @@ def delete_location(location_id: int):
         )
     
     # Удаляем локацию из хранилища
-    locations_storage.remove(location)
+    remove_location(location_id)
     
     return {
         "message": "Туристическая локация успешно удалена",
@@ -188,16 +447,11 @@ def search_locations(
     """
     Поиск туристических локаций по различным параметрам
     """
-    results = locations_storage.copy()
-    
-    if address:
-        results = [loc for loc in results if address.lower() in loc["addres"].lower()]
-    
-    if description:
-        results = [loc for loc in results if description.lower() in loc["description"].lower()]
-    
-    if work_time:
-        results = [loc for loc in results if work_time.lower() in loc["workTime"].lower()]
+    results = search_stored_locations({
+        "addres": address,
+        "description": description,
+        "workTime": work_time
+    })
     
     return {
         "found_count": len(results),
@@ -223,24 +477,27 @@ def get_location_contacts(location_id: int):
     }
 
 @router.get("/{location_id}/details")
-def get_location_details(location_id: int):
+def get_location_details(location_id: int, request: Request):
     """
     Получить детальную информацию о локации
     """
-    location = find_location(location_id)
-    
-    if location is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Туристическая локация не найдена"
-        )
+    def build():
+        location = find_location(location_id)
+        
+        if location is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Туристическая локация не найдена"
+            )
+        
+        return FastJSONResponse({
+            "location_id": location_id,
+            "address": location["addres"],
+            "coordinates": location["coords"],
+            "working_hours": location["workTime"],
+            "description": location["description"],
+            "photo": location["photo"],
+            "contacts": location["contacts"]
+        })
     
-    return {
-        "location_id": location_id,
-        "address": location["addres"],
-        "coordinates": location["coords"],
-        "working_hours": location["workTime"],
-        "description": location["description"],
-        "photo": location["photo"],
-        "contacts": location["contacts"]
-    }
+    return versioned_response(request, ("locations",), ("details", location_id), build)
@@ -0,0 +1,89 @@
+import os
+import secrets
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+from fastapi import Request, Response, status
+
+from fast_json import RawJSONResponse
+
+# Версии данных: увеличиваются при каждом изменении соответствующих данных
+data_versions: Dict[str, int] = {
+    "locations": 0,
+    "votes": 0
+}
+# Версии считаются заново после перезапуска, поэтому в ETag добавляется метка процесса
+_epoch = secrets.token_hex(4)
+RESPONSE_CACHE_SIZE = 1000
+# Суммарный размер закешированных тел ответов; ответ больше четверти лимита не кешируется
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = RESPONSE_CACHE_MAX_BYTES // 4
+# Заголовки ответа, которые сохраняются в кеше вместе с телом
+CACHED_HEADERS = ("x-next-after-id",)
+
+# {ключ: (версия, тело ответа, заголовки)}
+_responses: "OrderedDict[Hashable, Tuple[str, bytes, Dict[str, str]]]" = OrderedDict()
+_lock = threading.Lock()
+_cached_bytes = 0
+
+
+def bump_version(namespace: str):
+    """Отметить, что данные изменились (все закешированные ответы по ним устарели)"""
+    with _lock:
+        data_versions[namespace] += 1
+
+
+def current_version(namespaces: Tuple[str, ...]) -> str:
+    return ".".join(str(data_versions[namespace]) for namespace in namespaces)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def versioned_response(request: Request, namespaces: Tuple[str, ...], key: Hashable,
+                       build: Callable[[], Response]) -> Response:
+    """
+    Ответ с ETag по версии данных: 304, если у клиента актуальная версия,
+    готовое тело из кеша, если ответ для этой версии уже строился, иначе build()
+    """
+    version = current_version(namespaces)
+    etag = f'"{_epoch}-{version}-{zlib.crc32(repr(key).encode()):x}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    with _lock:
+        cached = _responses.get(key)
+        if cached is not None and cached[0] == version:
+            _responses.move_to_end(key)
+            return RawJSONResponse(cached[1], headers={**cached[2], **headers})
+
+    response = build()
+    if response.status_code == status.HTTP_200_OK and len(response.body) <= RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        extra_headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        _remember(key, version, namespaces, response.body, extra_headers)
+    response.headers.update(headers)
+    return response
+
+
+def _remember(key: Hashable, version: str, namespaces: Tuple[str, ...], body: bytes, extra_headers: Dict[str, str]):
+    """Сохранение ответа с вытеснением самых старых по числу записей и суммарному размеру"""
+    global _cached_bytes
+    with _lock:
+        # Если данные поменялись, пока строился ответ, он уже устарел
+        if current_version(namespaces) != version:
+            return
+        previous = _responses.pop(key, None)
+        if previous is not None:
+            _cached_bytes -= len(previous[1])
+        _responses[key] = (version, body, extra_headers)
+        _cached_bytes += len(body)
+        while len(_responses) > RESPONSE_CACHE_SIZE or _cached_bytes > RESPONSE_CACHE_MAX_BYTES:
+            _, evicted = _responses.popitem(last=False)
+            _cached_bytes -= len(evicted[1])
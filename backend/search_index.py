@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterable, List, Set
+from sqlalchemy import select, delete, insert, func, intersect
+
+from database import Location, LocationNgram
+
+# Поля локации, по которым работает поиск
+SEARCH_FIELDS = ["addres", "description", "workTime"]
+
+GRAM_SIZE = 3
+# Дополняем текст в конце, чтобы любая подстрока короче GRAM_SIZE
+# была префиксом хотя бы одной n-граммы
+PADDING = "\x01" * (GRAM_SIZE - 1)
+
+
+def normalize(text: Any) -> str:
+    """Приведение значения поля к виду, в котором оно хранится в индексе"""
+    if text is None:
+        return ""
+    return str(text).lower()
+
+
+def text_ngrams(text: Any) -> Set[str]:
+    """Множество n-грамм текста"""
+    padded = normalize(text) + PADDING
+    return {padded[i:i + GRAM_SIZE] for i in range(len(padded) - GRAM_SIZE + 1)}
+
+
+def index_location(session, location_id: int, fields: Dict[str, Any]):
+    """Добавление (или переиндексация) полей локации в индексе"""
+    for field in SEARCH_FIELDS:
+        if field not in fields:
+            continue
+        session.execute(
+            delete(LocationNgram).where(
+                LocationNgram.location_id == location_id,
+                LocationNgram.field == field
+            )
+        )
+        _insert_ngrams(session, [
+            {"field": field, "gram": gram, "location_id": location_id}
+            for gram in text_ngrams(fields[field])
+        ])
+
+
+def index_new_locations(session, locations: List[Dict[str, Any]]):
+    """Индексация пачки новых локаций одним запросом (без удаления старых n-грамм)"""
+    _insert_ngrams(session, [
+        {"field": field, "gram": gram, "location_id": location["id"]}
+        for location in locations
+        for field in SEARCH_FIELDS
+        if field in location
+        for gram in text_ngrams(location[field])
+    ])
+
+
+def _insert_ngrams(session, rows: List[Dict[str, Any]]):
+    if rows:
+        session.execute(insert(LocationNgram), rows)
+
+
+def unindex_location(session, location_id: int):
+    """Удаление локации из индекса"""
+    session.execute(delete(LocationNgram).where(LocationNgram.location_id == location_id))
+
+
+def _field_candidates(field: str, value: str):
+    """
+    Подзапрос: ID локаций, в поле которых есть все n-граммы запроса
+    (или n-грамма с таким префиксом, если запрос короче GRAM_SIZE)
+    """
+    query = select(LocationNgram.location_id).where(LocationNgram.field == field)
+    if len(value) < GRAM_SIZE:
+        return query.where(LocationNgram.gram >= value, LocationNgram.gram < value + "\U0010ffff").distinct()
+    grams = {value[i:i + GRAM_SIZE] for i in range(len(value) - GRAM_SIZE + 1)}
+    # Первичный ключ (field, gram, location_id): у локации каждая n-грамма поля встречается один раз
+    return (
+        query.where(LocationNgram.gram.in_(grams))
+        .group_by(LocationNgram.location_id)
+        .having(func.count() == len(grams))
+    )
+
+
+def search_rows(session, filters: Dict[str, str]) -> Iterable[Any]:
+    """
+    Локации, у которых каждое поле из filters содержит заданную подстроку.
+    Списки вхождений n-грамм пересекаются в самой БД, в Python приходят только кандидаты
+    """
+    filters = {field: normalize(value) for field, value in filters.items() if value}
+    if not filters:
+        return
+    candidates = [_field_candidates(field, value) for field, value in filters.items()]
+    candidate_ids = candidates[0] if len(candidates) == 1 else intersect(*candidates)
+    # Строки без ORM-объектов: при коротких запросах кандидатов много
+    rows = session.execute(
+        select(Location.__table__).where(Location.id.in_(candidate_ids)).order_by(Location.id)
+    )
+    for row in rows:
+        # n-граммы дают только кандидатов, точное совпадение проверяем по тексту
+        if all(value in normalize(getattr(row, field)) for field, value in filters.items()):
+            yield row
+
+
+def ensure_search_index(session):
+    """Построение индекса для локаций, сохраненных до его появления"""
+    indexed = session.scalar(select(func.count()).select_from(LocationNgram))
+    if indexed:
+        return
+    for row in session.scalars(select(Location)):
+        index_location(session, row.id, {field: getattr(row, field) for field in SEARCH_FIELDS})
+    session.commit()
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from journal import StateBackend, Journal, JournalError, JOURNAL_DIR, JOURNAL_FLUSH_INTERVAL_SECONDS
+
+# Где хранить состояние: "journal" - в памяти процесса с журналом на диске,
+# "sqlite" - общая для всех воркеров БД SQLite в режиме WAL
+STATE_BACKEND = os.getenv("STATE_BACKEND", "journal")
+STATE_DATABASE = Path(os.getenv("STATE_DATABASE", str(JOURNAL_DIR / "state.db")))
+# Как часто воркер подтягивает чужие изменения, даже если к нему нет запросов
+STATE_SYNC_INTERVAL_SECONDS = float(os.getenv("STATE_SYNC_INTERVAL_SECONDS", "1"))
+# Сколько секунд хранить записи, уже вошедшие в снимок: воркер, отставший
+# сильнее, загрузит снимок целиком
+STATE_LOG_RETENTION_SECONDS = int(os.getenv("STATE_LOG_RETENTION_SECONDS", "60"))
+# Как часто делать снимок состояния и удалять старые записи журнала
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStateBackend(StateBackend):
+    """
+    Общее состояние для нескольких воркеров через SQLite в режиме WAL.
+
+    Все изменения пишутся в общую таблицу state_log с глобальным порядковым
+    номером. Каждый воркер держит состояние в памяти (индексы, рейтинги,
+    счетчики остаются быстрыми) и перед обработкой запроса применяет записи,
+    появившиеся после последней примененной, в порядке номеров.
+
+    Свои записи воркер применяет сразу, а при чтении журнала применяет их
+    повторно на их месте в общем порядке: так чужое более раннее изменение
+    того же ключа не перекроет более позднее свое.
+
+    append() не пишет в БД сам (его вызывают и из event loop): записи в порядке
+    поступления вставляет фоновый поток, пачкой в одной транзакции, а
+    wait_durable() ждет коммита пачки. Ошибка записи пишется в лог, после
+    нее append() и wait_durable() бросают JournalError
+    """
+
+    def __init__(self, path: Path):
+        super().__init__()
+        self.path = path
+        self.origin = uuid.uuid4().hex
+        self._seq = 0
+        self._data_version = None
+        self._writer = None
+        self._reader = None
+        # Очередь записей для фонового потока: (номер, store, record, время)
+        self._pending: List[Tuple[int, str, str, float]] = []
+        self._queued = 0
+        self._written = 0
+        self._error: Optional[BaseException] = None
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        lock = threading.Lock()
+        self._condition = threading.Condition(lock)
+        self._flushed = threading.Condition(lock)
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        """Загрузка снимка и журнала из общей БД"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = self._connect()
+        self._writer.executescript("""
+            CREATE TABLE IF NOT EXISTS state_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                store TEXT NOT NULL,
+                record TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS state_snapshot (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL
+            );
+        """)
+        self._reader = self._connect()
+        with self._sync_lock:
+            self._load_snapshot()
+            self._apply_new_records()
+        self._thread = threading.Thread(target=self._write_loop, name="state-log-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, store: str, record: Dict[str, Any]) -> int:
+        """Поставить изменение в очередь записи в общий журнал (см. wait_durable)"""
+        if self._thread is None or getattr(self._local, "applying", False):
+            # Бэкенд еще не запущен или сейчас применяется чужая запись
+            return 0
+        data = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._condition:
+            self._check_error()
+            self._queued += 1
+            self._pending.append((self._queued, store, data, time.time()))
+            self._condition.notify()
+            return self._queued
+
+    def wait_durable(self, seq: int):
+        """Дождаться коммита пачки, в которую попала запись seq"""
+        if not seq:
+            return
+        with self._flushed:
+            while self._written < seq and self._error is None:
+                self._flushed.wait()
+            if self._written < seq:
+                self._check_error()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise JournalError("Общий журнал не записывается в БД") from self._error
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+            try:
+                self._write_batch(batch)
+            except Exception as error:
+                logger.exception("Ошибка записи в общий журнал, изменения больше не принимаются")
+                with self._condition:
+                    self._error = error
+                    self._pending = []
+                    self._flushed.notify_all()
+                return
+            with self._condition:
+                self._written = batch[-1][0]
+                self._flushed.notify_all()
+
+    def _write_batch(self, batch: List[Tuple[int, str, str, float]]):
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.executemany(
+                    "INSERT INTO state_log (origin, store, record, created) VALUES (?, ?, ?, ?)",
+                    [(self.origin, store, data, created) for _, store, data, created in batch]
+                )
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def broadcast(self, store: str, record: Dict[str, Any]):
+        self.append(store, record)
+
+    def sync(self):
+        """Применить записи, появившиеся в общем журнале"""
+        if self._reader is None:
+            return
+        with self._sync_lock:
+            # data_version меняется, только если в БД что-то закоммитили
+            data_version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+            self._apply_new_records()
+
+    def _apply_new_records(self):
+        rows = self._reader.execute(
+            "SELECT seq, store, record FROM state_log WHERE seq > ? ORDER BY seq", (self._seq,)
+        ).fetchall()
+        if (not rows or rows[0][0] > self._seq + 1) and self._load_snapshot():
+            # Часть журнала уже удалена после снимка - начинаем со снимка
+            rows = [row for row in rows if row[0] > self._seq]
+        self._local.applying = True
+        try:
+            for seq, store, record in rows:
+                handler = self._stores.get(store)
+                if handler is not None:
+                    handler["apply"](json.loads(record))
+                self._seq = seq
+        finally:
+            self._local.applying = False
+
+    def _load_snapshot(self) -> bool:
+        row = self._reader.execute("SELECT seq, data FROM state_snapshot WHERE id = 1").fetchone()
+        if row is None or row[0] <= self._seq:
+            return False
+        self._local.applying = True
+        try:
+            self._restore(json.loads(row[1]))
+        finally:
+            self._local.applying = False
+        self._seq = row[0]
+        return True
+
+    async def take_snapshot(self):
+        """Снимок состояния этого воркера, запись в БД - в отдельном потоке"""
+        if self._writer is None:
+            return
+        await asyncio.to_thread(self.sync)
+        seq = self._seq
+        states = self._export()
+        await asyncio.to_thread(self._write_snapshot, seq, states)
+
+    def _write_snapshot(self, seq: int, states: Dict[str, Any]):
+        data = json.dumps(states, ensure_ascii=False, separators=(",", ":"))
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                # Другой воркер мог уже сохранить более свежий снимок
+                self._writer.execute(
+                    "INSERT INTO state_snapshot (id, seq, data) VALUES (1, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET seq = excluded.seq, data = excluded.data "
+                    "WHERE excluded.seq > state_snapshot.seq",
+                    (seq, data)
+                )
+                self._writer.execute(
+                    "DELETE FROM state_log WHERE seq <= (SELECT seq FROM state_snapshot) AND created < ?",
+                    (time.time() - STATE_LOG_RETENTION_SECONDS,)
+                )
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        """Дописать очередь в общий журнал и закрыть соединения"""
+        if self._thread is not None:
+            with self._condition:
+                self._closing = True
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+        for connection in (self._writer, self._reader):
+            if connection is not None:
+                connection.close()
+        self._writer = self._reader = None
+
+
+def create_state_backend(kind: str) -> StateBackend:
+    """Бэкенд состояния по названию из настройки STATE_BACKEND"""
+    if kind == "journal":
+        return Journal(JOURNAL_DIR, JOURNAL_FLUSH_INTERVAL_SECONDS)
+    if kind == "sqlite":
+        return SharedStateBackend(STATE_DATABASE)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {kind} (ожидается journal или sqlite)")
+
+
+state_backend = create_state_backend(STATE_BACKEND)
+
+
+async def snapshot_loop():
+    """Фоновая задача: периодический снимок состояния"""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        await state_backend.take_snapshot()
+
+
+async def sync_loop():
+    """Фоновая задача: подтягивать изменения других воркеров, даже если запросов нет"""
+    while True:
+        await asyncio.sleep(STATE_SYNC_INTERVAL_SECONDS)
+        await asyncio.to_thread(state_backend.sync)
@@ -0,0 +1,169 @@
+import mimetypes
+import os
+import re
+import stat
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+
+# Сколько секунд доверять закешированному stat (для несуществующих файлов - меньше)
+STAT_CACHE_SECONDS = 60
+STAT_CACHE_MISSING_SECONDS = 2
+STAT_CACHE_SIZE = 10000
+RANGE_CHUNK_BYTES = 256 * 1024
+
+# Файлы, названные по sha256 содержимого (и их уменьшенные копии), никогда не меняются
+CONTENT_ADDRESSED_RE = re.compile(r"^([0-9a-f]{64})((?:\.[a-z]+)?)\.[a-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, no-cache"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# {путь: (момент устаревания записи, stat_result или None, etag)}
+_stat_cache: "OrderedDict[str, tuple]" = OrderedDict()
+# get_file - синхронный обработчик, кеш меняется из потоков threadpool'а
+_stat_cache_lock = threading.Lock()
+
+
+def _etag_for(path: Path, stat_result: os.stat_result) -> str:
+    """Сильный ETag: хеш из имени файла или mtime+размер"""
+    match = CONTENT_ADDRESSED_RE.match(path.name)
+    if match:
+        return f'"{match.group(1)}{match.group(2)}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def cached_stat(path: Path) -> Tuple[Optional[os.stat_result], Optional[str]]:
+    """stat файла и его ETag с кешированием; (None, None), если обычного файла нет"""
+    key = str(path)
+    now = time.monotonic()
+    with _stat_cache_lock:
+        entry = _stat_cache.get(key)
+        if entry is not None and entry[0] > now:
+            _stat_cache.move_to_end(key)
+            return entry[1], entry[2]
+
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        stat_result = None
+    if stat_result is not None and not stat.S_ISREG(stat_result.st_mode):
+        stat_result = None
+
+    if stat_result is None:
+        entry = (now + STAT_CACHE_MISSING_SECONDS, None, None)
+    else:
+        entry = (now + STAT_CACHE_SECONDS, stat_result, _etag_for(path, stat_result))
+    with _stat_cache_lock:
+        _stat_cache[key] = entry
+        _stat_cache.move_to_end(key)
+        while len(_stat_cache) > STAT_CACHE_SIZE:
+            _stat_cache.popitem(last=False)
+    return entry[1], entry[2]
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Проверка If-None-Match / If-Range (слабое сравнение)"""
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or any(
+        candidate.removeprefix("W/") == etag for candidate in candidates
+    )
+
+
+def _not_modified(request: Request, stat_result: os.stat_result, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Разбор одного диапазона bytes=start-end; None - диапазон невалидный"""
+    match = _RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        length = min(int(end), size)
+        return (size - length, size - 1) if length else None
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def _iter_file(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(RANGE_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(request: Request, path: Path, cacheable: bool = True) -> Optional[Response]:
+    """
+    Отдача файла с ETag, Last-Modified, Cache-Control,
+    ответом 304 на условные запросы и поддержкой Range.
+    cacheable=False - не разрешать долгое кеширование даже для неизменяемых файлов.
+    Возвращает None, если файла нет
+    """
+    stat_result, etag = cached_stat(path)
+    if stat_result is None:
+        return None
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL
+            if cacheable and CONTENT_ADDRESSED_RE.match(path.name)
+            else DEFAULT_CACHE_CONTROL
+        ),
+        "Accept-Ranges": "bytes"
+    }
+
+    if _not_modified(request, stat_result, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and "," not in range_header and (if_range is None or _etag_matches(if_range, etag)):
+        size = stat_result.st_size
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"}
+            )
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file(path, start, end),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            headers=headers,
+            media_type=mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        )
+
+    return FileResponse(path, stat_result=stat_result, headers=headers)
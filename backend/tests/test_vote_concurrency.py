@@ -0,0 +1,152 @@
+"""
+Нагрузочные проверки блокировок голосования: много потоков одновременно
+голосуют, меняют и удаляют оценки, а статистика и топы должны в точности
+совпадать с пересчетом по сохраненным голосам
+"""
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import voting_routes as voting
+
+THREADS = 16
+OPERATIONS_PER_THREAD = 1000
+LOCATIONS = 8
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Пустое состояние голосования и частое переключение потоков, чтобы гонки проявлялись"""
+    empty = {"votes": [], "sessions": []}
+    voting.restore_state(empty)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(switch_interval)
+    voting.restore_state(empty)
+
+
+@pytest.fixture
+def widened_races(monkeypatch):
+    """
+    Отдаем управление другому потоку между записью голоса и пересчетом статистики:
+    без блокировки локации потерянные обновления проявляются почти в каждом прогоне
+    """
+    update_stats = voting._update_stats
+
+    def yielding_update_stats(*args):
+        time.sleep(0)
+        update_stats(*args)
+
+    monkeypatch.setattr(voting, "_update_stats", yielding_update_stats)
+
+
+def run_threads(targets):
+    """Запуск потоков; возвращает исключения, выброшенные в них"""
+    errors = []
+
+    def guarded(target):
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=guarded, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def recount(location_id):
+    """Статистика локации, посчитанная заново по сохраненным голосам"""
+    columns = voting.votes_storage.location(location_id)
+    ratings = list(columns.ratings) if columns is not None else []
+    distribution = [0] * (voting.MAX_RATING - voting.MIN_RATING + 1)
+    for rating in ratings:
+        distribution[rating - voting.MIN_RATING] += 1
+    return len(ratings), sum(ratings), distribution
+
+
+def assert_stats_exact(locations=LOCATIONS):
+    for location_id in range(locations):
+        stats = voting.location_stats.get(location_id)
+        actual = (stats["total_votes"], stats["rating_sum"], stats["distribution"]) if stats else (0, 0, [0] * 5)
+        assert actual == recount(location_id), f"локация {location_id}"
+
+    rated = [location_id for location_id in range(locations) if location_id in voting.location_stats]
+    expected = sorted(rated, key=lambda location_id: (
+        -voting.average_rating(voting.location_stats[location_id]),
+        -voting.location_stats[location_id]["total_votes"],
+        location_id
+    ))
+    assert voting.leaderboards["average"].top(locations) == expected
+
+
+# Голоса разнесены по многим ключам / все потоки бьют в несколько голосов одной локации
+@pytest.mark.parametrize("locations, users", [(LOCATIONS, 200), (1, 5)])
+def test_mixed_vote_operations_keep_counts_exact(widened_races, locations, users):
+    def worker(seed):
+        generator = random.Random(seed)
+
+        def run():
+            for _ in range(OPERATIONS_PER_THREAD):
+                location_id = generator.randrange(locations)
+                user_id = f"user-{generator.randrange(users)}"
+                operation = generator.random()
+                if operation < 0.6:
+                    voting.set_vote(location_id, user_id, generator.randint(1, 5))
+                elif operation < 0.8:
+                    voting.set_vote(location_id, user_id, generator.randint(1, 5), only_existing=True)
+                elif operation < 0.95:
+                    voting.delete_vote(location_id, user_id)
+                else:
+                    # Чтение и снимок состояния одновременно с записью
+                    voting.vote_log.recent_votes(50)
+                    voting.leaderboards["average"].top(5)
+                    voting.export_state()
+        return run
+
+    errors = run_threads([worker(seed) for seed in range(THREADS)])
+
+    assert errors == []
+    assert_stats_exact(locations)
+
+
+def test_parallel_first_votes_are_not_lost(widened_races):
+    """Каждый пользователь голосует один раз за одну и ту же локацию"""
+    def worker(thread_number):
+        def run():
+            for user_number in range(OPERATIONS_PER_THREAD):
+                voting.set_vote(0, f"user-{thread_number}-{user_number}", user_number % 5 + 1)
+        return run
+
+    errors = run_threads([worker(thread_number) for thread_number in range(THREADS)])
+
+    assert errors == []
+    assert voting.get_stats(0)["total_votes"] == THREADS * OPERATIONS_PER_THREAD
+    assert_stats_exact()
+
+
+def test_session_cleanup_while_sessions_are_created():
+    def create_sessions():
+        session_id = None
+        for number in range(OPERATIONS_PER_THREAD):
+            # Половина запросов продлевает свою сессию, половина создает новую
+            session_id, _ = voting.get_or_create_user_id(session_id if number % 2 else None)
+
+    def cleanup():
+        for _ in range(300):
+            voting.cleanup_expired_sessions(datetime.now() + timedelta(hours=voting.SESSION_DURATION_HOURS + 1))
+
+    errors = run_threads([create_sessions] * (THREADS // 2) + [cleanup] * 2)
+
+    assert errors == []
+    voting.cleanup_expired_sessions(datetime.now() + timedelta(hours=voting.SESSION_DURATION_HOURS + 1))
+    assert voting.user_sessions == {}
+    assert voting.session_expiry_heap == []
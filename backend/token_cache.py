@@ -0,0 +1,47 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class TokenCache:
+    """
+    LRU-кеш проверенных токенов: {sha256(token): (payload, exp)}.
+    Запись живет не дольше срока действия самого токена
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Payload токена из кеша или None, если его нет или срок истек"""
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    def put(self, token: str, payload: Dict[str, Any]):
+        """Сохранить проверенный payload (exp берется из самого токена)"""
+        expires_at = payload.get("exp")
+        if expires_at is None:
+            return
+        key = self._key(token)
+        self._entries[key] = (payload, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, token: str):
+        """Убрать токен из кеша"""
+        self._entries.pop(self._key(token), None)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+UPLOAD_DIR = Path("uploads")
+UPLOAD_DIR.mkdir(exist_ok=True)
+
+# Ограничение на размер одного файла
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Размер блока при чтении и записи загружаемого файла
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Запас на остальные поля формы и разделители multipart
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+_EXTENSION_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Файл больше {MAX_UPLOAD_BYTES // (1024 * 1024)} МБ"
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Ограничение размера тела запросов на загрузку до разбора формы.
+    Starlette сохраняет весь multipart во временный файл еще до вызова
+    обработчика, поэтому проверять размер в нем уже поздно: запрос с большим
+    Content-Length отклоняется сразу, а тело без него (chunked) - как только
+    прочитано больше max_body_bytes
+    """
+
+    def __init__(self, app, paths, max_body_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            error = _too_large()
+            response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise _too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def file_extension(filename: str) -> str:
+    """Безопасное расширение файла (или пустая строка)"""
+    extension = Path(filename or "").suffix.lower()
+    return extension if _EXTENSION_RE.match(extension) else ""
+
+
+def _finish_upload(temp_path: Path, final_path: Path):
+    """Перенос временного файла на место (или удаление, если такой файл уже есть)"""
+    if final_path.exists():
+        temp_path.unlink()
+    else:
+        os.replace(temp_path, final_path)
+
+
+async def save_upload(file: UploadFile) -> str:
+    """
+    Потоковое сохранение загруженного файла блоками по UPLOAD_CHUNK_BYTES.
+    Файл называется по sha256 содержимого, поэтому одинаковые фото хранятся один раз.
+    Возвращает имя сохраненного файла
+    """
+    temp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    output = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise _too_large()
+            digest.update(chunk)
+            await run_in_threadpool(output.write, chunk)
+        await run_in_threadpool(output.close)
+
+        filename = digest.hexdigest() + file_extension(file.filename)
+        await run_in_threadpool(_finish_upload, temp_path, UPLOAD_DIR / filename)
+        return filename
+    except BaseException:
+        output.close()
+        temp_path.unlink(missing_ok=True)
+        raise
@@ -1,3 +1,4 @@
+import codecs
 import json
 
 
@@ -22,15 +23,153 @@ def dict_list_to_json(dict_list, filename):
 def json_to_dict_list(filename):
     """
     Преобразует JSON-строку из файла в список словарей.
+    Для больших файлов лучше обходить элементы через iter_json_items.
 
-    :param filename: Имя файла с JSON-строкой
+    :param filename: Имя файла с JSON-массивом или NDJSON
     :return: Список словарей или None в случае ошибки
     """
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            json_str = file.read()
-            dict_list = json.loads(json_str)
-        return dict_list
+        return list(iter_json_items(filename))
     except (TypeError, ValueError, IOError) as e:
         print(f"Ошибка при чтении JSON из файла или преобразовании в список словарей: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+class IncrementalJSONParser:
+    """
+    Потоковый разбор JSON: данные подаются кусками через feed(), разобранные
+    элементы возвращаются сразу. Поддерживаются NDJSON (по объекту на строку)
+    и JSON-массив верхнего уровня. В памяти держится только текущий элемент.
+    """
+
+    def __init__(self, max_item_size=10 * 1024 * 1024):
+        """
+        :param max_item_size: Максимальный размер одного элемента в символах
+        """
+        self.max_item_size = max_item_size
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._is_array = None
+        self._array_closed = False
+
+    def feed(self, chunk):
+        """
+        Добавляет очередной кусок данных.
+
+        :param chunk: bytes или str
+        :return: Список полностью разобранных элементов
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        self._buffer += chunk
+        return self._parse(final=False)
+
+    def close(self):
+        """
+        Завершает разбор.
+
+        :return: Список оставшихся элементов
+        :raises ValueError: Если данные оборвались или некорректны
+        """
+        self._buffer += self._text_decoder.decode(b"", final=True)
+        items = self._parse(final=True)
+        if self._is_array and not self._array_closed:
+            raise ValueError("JSON-массив не закрыт")
+        return items
+
+    def _skip(self, position):
+        """Пропуск пробелов и разделителей между элементами"""
+        separators = " \t\r\n," if self._is_array else " \t\r\n"
+        while position < len(self._buffer) and self._buffer[position] in separators:
+            position += 1
+        return position
+
+    def _parse(self, final):
+        items = []
+        position = 0
+        while True:
+            position = self._skip(position)
+            if position >= len(self._buffer) or self._array_closed:
+                break
+
+            if self._is_array is None:
+                self._is_array = self._buffer[position] == "["
+                if self._is_array:
+                    position += 1
+                    continue
+            if self._is_array and self._buffer[position] == "]":
+                self._array_closed = True
+                position += 1
+                break
+
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, position)
+            except ValueError:
+                if final:
+                    raise
+                if len(self._buffer) - position > self.max_item_size:
+                    raise ValueError("Слишком большой элемент JSON")
+                break
+            # Число в конце куска могло оборваться - ждем следующий кусок
+            if end == len(self._buffer) and not final and not isinstance(item, (dict, list)):
+                break
+            items.append(item)
+            position = end
+
+        self._buffer = self._buffer[position:]
+        if self._array_closed and self._buffer.strip():
+            raise ValueError("Лишние данные после JSON-массива")
+        return items
+
+
+def iter_json_items(filename, chunk_size=64 * 1024):
+    """
+    Потоково читает элементы из файла с JSON-массивом или NDJSON.
+
+    :param filename: Имя файла
+    :param chunk_size: Размер читаемого блока в байтах
+    :return: Генератор словарей
+    """
+    parser = IncrementalJSONParser()
+    with open(filename, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def write_ndjson(items, filename):
+    """
+    Потоково записывает элементы в файл в формате NDJSON (по объекту на строку).
+
+    :param items: Итерируемый набор словарей (например, генератор)
+    :param filename: Имя файла
+    :return: Количество записанных элементов
+    """
+    count = 0
+    with open(filename, 'w', encoding='utf-8') as file:
+        for item in items:
+            file.write(json.dumps(item, ensure_ascii=False))
+            file.write("\n")
+            count += 1
+    return count
+
+
+def write_json_array(items, filename):
+    """
+    Потоково записывает элементы в файл в виде JSON-массива.
+
+    :param items: Итерируемый набор словарей (например, генератор)
+    :param filename: Имя файла
+    :return: Количество записанных элементов
+    """
+    count = 0
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write("[")
+        for item in items:
+            if count:
+                file.write(",\n")
+            file.write(json.dumps(item, ensure_ascii=False))
+            count += 1
+        file.write("]")
+    return count
@@ -0,0 +1,128 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не установлен - считаем обычными циклами
+    np = None
+
+SECONDS_PER_DAY = 86400
+# Результаты аналитики пересчитываются не чаще раза в ANALYTICS_BUCKET_SECONDS
+ANALYTICS_BUCKET_SECONDS = 60
+ANALYTICS_CACHE_SIZE = 256
+
+# {ключ: (номер интервала, результат)}
+_cache: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def current_bucket(now: Optional[float] = None) -> int:
+    """Номер текущего интервала кеширования"""
+    return int((now if now is not None else time.time()) // ANALYTICS_BUCKET_SECONDS)
+
+
+def cached(key: Hashable, compute: Callable[[], Any]) -> Any:
+    """
+    Результат из кеша, если он посчитан в текущем интервале, иначе compute().
+    Частые обновления дашборда не пересчитывают данные по всем голосам
+    """
+    bucket = current_bucket()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == bucket:
+            _cache.move_to_end(key)
+            return entry[1]
+    result = compute()
+    with _cache_lock:
+        _cache[key] = (bucket, result)
+        _cache.move_to_end(key)
+        while len(_cache) > ANALYTICS_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def _day_label(day: int) -> str:
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc).date().isoformat()
+
+
+def daily_totals(ratings: array, timestamps: array, first_day: int, days: int) -> Tuple[List[int], List[int]]:
+    """
+    Число голосов и сумма оценок по дням (UTC) за days дней, начиная с first_day
+    (номер дня от начала эпохи). Голоса вне этого периода не учитываются
+    """
+    if np is not None:
+        day_numbers = np.frombuffer(timestamps, dtype=np.int32) // SECONDS_PER_DAY - first_day
+        mask = (day_numbers >= 0) & (day_numbers < days)
+        selected = day_numbers[mask]
+        counts = np.bincount(selected, minlength=days)
+        sums = np.bincount(selected, weights=np.frombuffer(ratings, dtype=np.int8)[mask], minlength=days)
+        return counts.tolist(), sums.astype(np.int64).tolist()
+
+    counts = [0] * days
+    sums = [0] * days
+    for rating, timestamp in zip(ratings, timestamps):
+        day = timestamp // SECONDS_PER_DAY - first_day
+        if 0 <= day < days:
+            counts[day] += 1
+            sums[day] += rating
+    return counts, sums
+
+
+def _rolling(values: List[int], window: int) -> List[int]:
+    """Сумма за последние window элементов для каждой позиции"""
+    if np is not None:
+        cumulative = np.cumsum(np.asarray(values, dtype=np.int64))
+        shifted = np.concatenate((np.zeros(window, dtype=np.int64), cumulative[:-window]))
+        return (cumulative - shifted).tolist()
+
+    result = []
+    total = 0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        result.append(total)
+    return result
+
+
+def daily_series(ratings: array, timestamps: array, days: int, window: int,
+                 now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Голоса по дням за последние days дней: число голосов, средняя оценка
+    за день и скользящая средняя за window дней (None, если голосов не было)
+    """
+    today = int((now if now is not None else time.time()) // SECONDS_PER_DAY)
+    # Для скользящего окна нужны еще window - 1 дней до начала периода
+    first_day = today - days - window + 2
+    counts, sums = daily_totals(ratings, timestamps, first_day, days + window - 1)
+    rolling_counts = _rolling(counts, window)
+    rolling_sums = _rolling(sums, window)
+
+    series = []
+    for i in range(window - 1, len(counts)):
+        series.append({
+            "date": _day_label(first_day + i),
+            "votes": counts[i],
+            "average_rating": round(sums[i] / counts[i], 2) if counts[i] else None,
+            "rolling_average": round(rolling_sums[i] / rolling_counts[i], 2) if rolling_counts[i] else None
+        })
+    return series
+
+
+def rating_histogram(ratings: array, timestamps: array, since: int,
+                     min_rating: int, max_rating: int) -> List[int]:
+    """Число голосов с каждой оценкой (от min_rating до max_rating), отданных не раньше since"""
+    size = max_rating - min_rating + 1
+    if np is not None:
+        selected = np.frombuffer(ratings, dtype=np.int8)[np.frombuffer(timestamps, dtype=np.int32) >= since]
+        return np.bincount(selected.astype(np.int64) - min_rating, minlength=size).tolist()
+
+    histogram = [0] * size
+    for rating, timestamp in zip(ratings, timestamps):
+        if timestamp >= since:
+            histogram[rating - min_rating] += 1
+    return histogram
@@ -0,0 +1,91 @@
+import threading
+from collections import deque
+from itertools import count
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+class VoteLog:
+    """
+    Журнал изменений голосов в порядке времени.
+    Хранит только последние max_events событий (кольцевой буфер),
+    поэтому память не растет вместе с общим числом голосов.
+    Методы можно вызывать из разных потоков
+    """
+
+    def __init__(self, max_events: int):
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self._sequence = count(1)
+        self.last_seq = 0
+        # Номер последнего события по каждому голосу: {(location_id, user_id): seq}
+        self._latest: Dict[Tuple[int, str], int] = {}
+        self._lock = threading.Lock()
+
+    def append(self, action: str, location_id: int, user_id: str,
+               rating: Optional[int], timestamp: str) -> Dict[str, Any]:
+        """Записать событие: action - "rate" или "remove" """
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                # Самое старое событие вытесняется из буфера
+                oldest = self._events[0]
+                key = (oldest["location_id"], oldest["user_id"])
+                if self._latest.get(key) == oldest["seq"]:
+                    del self._latest[key]
+            self.last_seq = next(self._sequence)
+            event = {
+                "seq": self.last_seq,
+                "action": action,
+                "location_id": location_id,
+                "user_id": user_id,
+                "rating": rating,
+                "timestamp": timestamp
+            }
+            self._events.append(event)
+            self._latest[(location_id, user_id)] = self.last_seq
+        return event
+
+    def clear(self):
+        """Удалить все события (номера продолжают расти, чтобы курсоры клиентов оставались верными)"""
+        with self._lock:
+            self._events.clear()
+            self._latest.clear()
+
+    def _is_current_vote(self, event: Dict[str, Any]) -> bool:
+        """Голос, который потом не меняли и не удаляли"""
+        return event["action"] == "rate" and self._latest.get((event["location_id"], event["user_id"])) == event["seq"]
+
+    def recent_votes(self, limit: int, since: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Актуальные голоса, начиная с самых новых.
+        Голос, который потом изменили или удалили, не попадает в выдачу.
+        since - вернуть только события с номером больше since; если таких голосов
+        больше limit, отдаются самые ранние из них, а остальные - по следующему курсору.
+        Возвращает голоса и курсор для следующего запроса.
+        Просматриваются только нужные события, а не весь буфер
+        """
+        votes = []
+        with self._lock:
+            cursor = self.last_seq
+            if since is None:
+                for event in reversed(self._events):
+                    if len(votes) >= limit:
+                        break
+                    if self._is_current_vote(event):
+                        votes.append(event)
+                return votes, cursor
+
+            # Номера событий в буфере идут подряд, поэтому позиция since вычисляется сразу
+            first_seq = self._events[0]["seq"] if self._events else cursor + 1
+            position = max(since + 1 - first_seq, 0)
+            scanned = since
+            while position < len(self._events):
+                event = self._events[position]
+                if len(votes) >= limit:
+                    # Не поместившиеся события клиент получит следующим запросом
+                    cursor = scanned
+                    break
+                scanned = event["seq"]
+                if self._is_current_vote(event):
+                    votes.append(event)
+                position += 1
+        votes.reverse()
+        return votes, cursor
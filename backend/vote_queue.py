@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Ключ голоса: (location_id, user_id)
+VoteKey = Tuple[int, str]
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Очередь заполнена, голос не принят"""
+
+
+class VoteQueue:
+    """
+    Очередь голосов для пакетной записи.
+
+    Голос сразу подтверждается клиенту и кладется в очередь, а фоновый поток
+    раз в flush_interval (или когда набралось batch_size голосов) применяет
+    накопленное одной пачкой. Повторный голос того же пользователя за ту же
+    локацию заменяет еще не записанный (в очереди хранится только последний).
+    Размер очереди ограничен: при переполнении put() выбрасывает QueueFull
+    """
+
+    def __init__(self, apply_batch: Callable[[List[Tuple[VoteKey, Dict[str, Any]]]], None],
+                 max_size: int, batch_size: int, flush_interval: float):
+        """
+        apply_batch получает список (ключ, голос), где голос - {"rating": int, "timestamp": str}.
+        Если пачка не записалась, голоса применяются повторно по одному, поэтому
+        повторное применение уже записанного голоса не должно ничего менять
+        """
+        self.apply_batch = apply_batch
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[VoteKey, Dict[str, Any]] = {}
+        self._condition = threading.Condition()
+        # Удерживается, пока пачка применяется: take() дожидается ее окончания
+        self._apply_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._oldest_pending: Optional[float] = None
+        self.metrics = {
+            "accepted": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "applied": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_seconds": 0.0
+        }
+
+    def start(self):
+        """Запуск фонового потока записи"""
+        if self._thread is None:
+            self._closing = False
+            self._thread = threading.Thread(target=self._run, name="vote-queue", daemon=True)
+            self._thread.start()
+
+    def put(self, key: VoteKey, vote: Dict[str, Any]):
+        """Поставить голос в очередь"""
+        with self._condition:
+            if key in self._pending:
+                self.metrics["coalesced"] += 1
+            elif len(self._pending) >= self.max_size:
+                self.metrics["rejected"] += 1
+                raise QueueFull()
+            if not self._pending:
+                self._oldest_pending = time.monotonic()
+            self._pending[key] = vote
+            self.metrics["accepted"] += 1
+            # Будим поток, чтобы он начал отсчет flush_interval (или сразу записал полную пачку)
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def pending_vote(self, key: VoteKey) -> Optional[Dict[str, Any]]:
+        """Еще не записанный голос (для чтения своих записей)"""
+        with self._condition:
+            return self._pending.get(key)
+
+    def take(self, key: VoteKey) -> Optional[Dict[str, Any]]:
+        """
+        Забрать голос из очереди, чтобы применить его сразу.
+        Дожидается пачки, которая применяется в этот момент, чтобы старый
+        голос не записался поверх нового
+        """
+        with self._apply_lock:
+            with self._condition:
+                return self._pending.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики очереди: глубина, заполненность и счетчики"""
+        with self._condition:
+            depth = len(self._pending)
+            oldest = self._oldest_pending
+        return {
+            **self.metrics,
+            "depth": depth,
+            "capacity": self.max_size,
+            "utilization": round(depth / self.max_size, 3),
+            "oldest_pending_seconds": round(time.monotonic() - oldest, 3) if depth and oldest else 0.0
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending and self._closing:
+                    return
+                if len(self._pending) < self.batch_size and not self._closing:
+                    # Даем пачке набраться
+                    self._condition.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка при записи пачки голосов")
+
+    def flush(self):
+        """Применить все накопленные голоса"""
+        with self._apply_lock:
+            with self._condition:
+                batch, self._pending = self._pending, {}
+                self._oldest_pending = None
+            if not batch:
+                return
+            started = time.monotonic()
+            items = list(batch.items())
+            try:
+                self.apply_batch(items)
+                applied, failed = len(items), 0
+            except Exception:
+                logger.exception("Пачка из %d голосов не записалась, записываем голоса по одному", len(items))
+                applied, failed = self._apply_one_by_one(items)
+            self.metrics["applied"] += applied
+            self.metrics["failed"] += failed
+            self.metrics["batches"] += 1
+            self.metrics["last_batch_size"] = len(batch)
+            self.metrics["max_batch_size"] = max(self.metrics["max_batch_size"], len(batch))
+            self.metrics["last_flush_seconds"] = round(time.monotonic() - started, 6)
+
+    def _apply_one_by_one(self, items: List[Tuple[VoteKey, Dict[str, Any]]]) -> Tuple[int, int]:
+        """
+        Запись голосов по одному после ошибки пачки: часть пачки могла уже
+        примениться, а один некорректный голос не должен терять остальные.
+        Возвращает число записанных и незаписанных голосов
+        """
+        applied = failed = 0
+        for item in items:
+            try:
+                self.apply_batch([item])
+                applied += 1
+            except Exception:
+                failed += 1
+                logger.exception("Голос %s не записан", item[0])
+        return applied, failed
+
+    def close(self):
+        """Записать оставшиеся голоса и остановить поток"""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self.flush()
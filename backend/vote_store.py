@@ -0,0 +1,163 @@
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def to_epoch(timestamp: str) -> int:
+    """Время в формате isoformat -> секунды с начала эпохи"""
+    return int(datetime.fromisoformat(timestamp).timestamp())
+
+
+def from_epoch(seconds: int) -> str:
+    """Секунды с начала эпохи -> время в формате isoformat"""
+    return datetime.fromtimestamp(seconds).isoformat()
+
+
+class UserInterner:
+    """
+    Сопоставление строковых ID пользователей (UUID) с номерами.
+    Каждая строка хранится один раз, в голосах - только 4-байтовый номер
+    """
+
+    def __init__(self):
+        self._numbers: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def number(self, user_id: str) -> int:
+        """Номер пользователя (новый пользователь получает следующий номер)"""
+        number = self._numbers.get(user_id)
+        if number is None:
+            # Новых пользователей могут добавлять потоки, меняющие разные локации
+            with self._lock:
+                number = self._numbers.get(user_id)
+                if number is None:
+                    number = self._numbers[user_id] = len(self._ids)
+                    self._ids.append(user_id)
+        return number
+
+    def find(self, user_id: str) -> Optional[int]:
+        """Номер пользователя или None, если он еще не голосовал"""
+        return self._numbers.get(user_id)
+
+    def user_id(self, number: int) -> str:
+        return self._ids[number]
+
+    def clear(self):
+        with self._lock:
+            self._numbers.clear()
+            self._ids.clear()
+
+
+class LocationVotes:
+    """
+    Голоса одной локации в трех столбцах, отсортированных по номеру пользователя:
+    номера пользователей (int32), оценки (int8) и время голоса (int32, секунды).
+    Поиск голоса - бинарный поиск, вставка и удаление - сдвиг массива
+    """
+
+    __slots__ = ("users", "ratings", "timestamps")
+
+    def __init__(self):
+        self.users = array("i")
+        self.ratings = array("b")
+        self.timestamps = array("i")
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def _position(self, user: int) -> Tuple[int, bool]:
+        position = bisect_left(self.users, user)
+        return position, position < len(self.users) and self.users[position] == user
+
+    def get(self, user: int) -> Optional[Tuple[int, int]]:
+        position, found = self._position(user)
+        if not found:
+            return None
+        return self.ratings[position], self.timestamps[position]
+
+    def set(self, user: int, rating: int, timestamp: int) -> Optional[int]:
+        position, found = self._position(user)
+        if found:
+            old_rating = self.ratings[position]
+            self.ratings[position] = rating
+            self.timestamps[position] = timestamp
+            return old_rating
+        self.users.insert(position, user)
+        self.ratings.insert(position, rating)
+        self.timestamps.insert(position, timestamp)
+        return None
+
+    def remove(self, user: int) -> Optional[int]:
+        position, found = self._position(user)
+        if not found:
+            return None
+        old_rating = self.ratings[position]
+        del self.users[position]
+        del self.ratings[position]
+        del self.timestamps[position]
+        return old_rating
+
+
+class VoteStore:
+    """
+    Компактное хранилище голосов: {location_id: LocationVotes} и общий
+    справочник пользователей. Голос занимает 9 байт вместо словаря со
+    строками (сотни байт). Для одной локации вызовы нужно защищать одной
+    блокировкой, разные локации можно менять параллельно
+    """
+
+    def __init__(self):
+        self.users = UserInterner()
+        self._locations: Dict[int, LocationVotes] = {}
+
+    def __len__(self) -> int:
+        return sum(len(votes) for votes in list(self._locations.values()))
+
+    def get(self, location_id: int, user_id: str) -> Optional[Tuple[int, int]]:
+        """Голос пользователя: (оценка, время в секундах) или None"""
+        votes = self._locations.get(location_id)
+        user = self.users.find(user_id)
+        if votes is None or user is None:
+            return None
+        return votes.get(user)
+
+    def set(self, location_id: int, user_id: str, rating: int, timestamp: int) -> Optional[int]:
+        """Сохранить голос, возвращает предыдущую оценку"""
+        votes = self._locations.get(location_id)
+        if votes is None:
+            votes = self._locations.setdefault(location_id, LocationVotes())
+        return votes.set(self.users.number(user_id), rating, timestamp)
+
+    def remove(self, location_id: int, user_id: str) -> Optional[int]:
+        """Удалить голос, возвращает удаленную оценку"""
+        votes = self._locations.get(location_id)
+        user = self.users.find(user_id)
+        if votes is None or user is None:
+            return None
+        old_rating = votes.remove(user)
+        if not votes:
+            del self._locations[location_id]
+        return old_rating
+
+    def location(self, location_id: int) -> Optional[LocationVotes]:
+        """Столбцы голосов локации (для пакетной обработки)"""
+        return self._locations.get(location_id)
+
+    def location_ids(self) -> List[int]:
+        return list(self._locations)
+
+    def items(self) -> Iterator[Tuple[int, str, int, int]]:
+        """Все голоса: (location_id, user_id, оценка, время в секундах)"""
+        for location_id, votes in list(self._locations.items()):
+            for user, rating, timestamp in zip(votes.users, votes.ratings, votes.timestamps):
+                yield location_id, self.users.user_id(user), rating, timestamp
+
+    def clear(self):
+        self._locations.clear()
+        self.users.clear()
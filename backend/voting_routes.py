@@ -1,43 +1,334 @@
-from fastapi import APIRouter, status, HTTPException, Cookie, Response
+from fastapi import APIRouter, status, HTTPException, Cookie, Response, Request, Query
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
+import asyncio
+import heapq
+import os
+import threading
+import time
 import uuid
+from array import array
+from contextlib import contextmanager, ExitStack
 
-router = APIRouter(prefix="/voting", tags=["voting"])
+from leaderboard import Leaderboard
+from vote_log import VoteLog
+from vote_queue import VoteQueue, QueueFull
+from vote_store import VoteStore, to_epoch, from_epoch
+from vote_analytics import cached, daily_series, rating_histogram, SECONDS_PER_DAY
+from fast_json import FastJSONResponse
+from response_cache import bump_version, versioned_response
+from state_backend import state_backend
 
+router = APIRouter(prefix="/voting", tags=["voting"], default_response_class=FastJSONResponse)
 
-votes_storage = {} # {location_id: {user_id: rating}}
+
+# Голоса в компактном виде: {location_id: столбцы (пользователь, оценка, время)}
+votes_storage = VoteStore()
 user_sessions = {} # {session_id: {user_id, last_activity}}
+# Очередь проверки сессий: [(время проверки, session_id)]; при продлении сессии
+# запись не обновляется, а переносится при проверке (см. cleanup_expired_sessions)
+session_expiry_heap = []
+# Накопленная статистика по локации, обновляется при каждом изменении голоса
+# {location_id: {"total_votes": int, "rating_sum": int, "distribution": [count for each rating]}}
+location_stats = {}
+# Блокировки голосов: локация защищается одной из LOCK_STRIPES блокировок
+# (по location_id), поэтому голоса за разные локации не ждут друг друга.
+# Изменение и запись в журнал идут под одной блокировкой, чтобы порядок совпадал
+LOCK_STRIPES = 64
+location_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+# Блокировка сессий (user_sessions и session_expiry_heap)
+session_lock = threading.Lock()
 
 
 MAX_RATING = 5
 MIN_RATING = 1
 SESSION_DURATION_HOURS = 24
+# Как часто фоновая задача удаляет просроченные сессии
+SESSION_CLEANUP_INTERVAL_SECONDS = 60
+
+# Параметры взвешенного (байесовского) рейтинга: каждая локация как будто
+# уже имеет PRIOR_VOTES голосов со средней оценкой PRIOR_RATING
+PRIOR_RATING = 3.0
+PRIOR_VOTES = 5
+
+# Асинхронный прием голосов: /rate сразу отвечает, а голоса записываются
+# пачками раз в VOTE_FLUSH_INTERVAL_SECONDS (или по VOTE_BATCH_SIZE штук)
+VOTE_QUEUE_ENABLED = os.getenv("VOTE_QUEUE_ENABLED", "0") == "1"
+VOTE_QUEUE_SIZE = int(os.getenv("VOTE_QUEUE_SIZE", "100000"))
+VOTE_BATCH_SIZE = int(os.getenv("VOTE_BATCH_SIZE", "5000"))
+VOTE_FLUSH_INTERVAL_SECONDS = float(os.getenv("VOTE_FLUSH_INTERVAL_SECONDS", "0.05"))
+
+# Сколько последних изменений голосов хранить для /recent-votes
+VOTE_LOG_SIZE = 10000
+vote_log = VoteLog(VOTE_LOG_SIZE)
+
+# Топы локаций, поддерживаются в отсортированном виде при каждом голосе
+leaderboards = {
+    "average": Leaderboard(),
+    "weighted": Leaderboard()
+}
+
+
+def location_lock(location_id: int) -> threading.Lock:
+    """Блокировка, защищающая голоса и статистику локации"""
+    return location_locks[hash(location_id) % LOCK_STRIPES]
+
+@contextmanager
+def all_locks():
+    """Все блокировки сразу (всегда в одном порядке) - для снимка и загрузки состояния"""
+    with ExitStack() as stack:
+        for lock in location_locks:
+            stack.enter_context(lock)
+        stack.enter_context(session_lock)
+        yield
+
+def average_rating(stats: Dict[str, Any]) -> float:
+    """Средняя оценка локации"""
+    return round(stats["rating_sum"] / stats["total_votes"], 2)
+
+def weighted_rating(stats: Dict[str, Any]) -> float:
+    """Средняя оценка, сглаженная к PRIOR_RATING для локаций с малым числом голосов"""
+    return round(
+        (PRIOR_RATING * PRIOR_VOTES + stats["rating_sum"]) / (PRIOR_VOTES + stats["total_votes"]),
+        2
+    )
+
+
+def _update_stats(location_id: int, old_rating: Optional[int], new_rating: Optional[int]):
+    """Пересчет статистики локации при изменении одного голоса"""
+    stats = location_stats.get(location_id)
+    if stats is None:
+        stats = location_stats[location_id] = {
+            "total_votes": 0,
+            "rating_sum": 0,
+            "distribution": [0] * (MAX_RATING - MIN_RATING + 1)
+        }
+    
+    if old_rating is not None:
+        stats["total_votes"] -= 1
+        stats["rating_sum"] -= old_rating
+        stats["distribution"][old_rating - MIN_RATING] -= 1
+    if new_rating is not None:
+        stats["total_votes"] += 1
+        stats["rating_sum"] += new_rating
+        stats["distribution"][new_rating - MIN_RATING] += 1
+    
+    if stats["total_votes"] == 0:
+        del location_stats[location_id]
+        for leaderboard in leaderboards.values():
+            leaderboard.remove(location_id)
+    else:
+        leaderboards["average"].update(location_id, average_rating(stats), stats["total_votes"])
+        leaderboards["weighted"].update(location_id, weighted_rating(stats), stats["total_votes"])
+
+def _store_vote(location_id: int, user_id: str, rating: int, timestamp: str) -> Optional[int]:
+    seconds = to_epoch(timestamp)
+    old_vote = votes_storage.get(location_id, user_id)
+    if old_vote == (rating, seconds):
+        # Повторное применение того же изменения (например, своей записи из общего журнала)
+        return rating
+    old_rating = votes_storage.set(location_id, user_id, rating, seconds)
+    _update_stats(location_id, old_rating, rating)
+    vote_log.append("rate", location_id, user_id, rating, timestamp)
+    bump_version("votes")
+    return old_rating
+
+def _drop_vote(location_id: int, user_id: str, timestamp: str) -> Optional[int]:
+    old_rating = votes_storage.remove(location_id, user_id)
+    if old_rating is None:
+        return None
+    _update_stats(location_id, old_rating, None)
+    vote_log.append("remove", location_id, user_id, None, timestamp)
+    bump_version("votes")
+    return old_rating
+
+def set_vote(location_id: int, user_id: str, rating: int, only_existing: bool = False) -> Optional[int]:
+    """
+    Сохранить голос пользователя, возвращает предыдущую оценку.
+    only_existing - только изменить уже существующий голос (иначе ничего не делать)
+    """
+    timestamp = datetime.now().isoformat()
+    with location_lock(location_id):
+        if only_existing and votes_storage.get(location_id, user_id) is None:
+            return None
+        old_rating = _store_vote(location_id, user_id, rating, timestamp)
+        seq = state_backend.append("voting", {
+            "op": "vote", "location_id": location_id, "user_id": user_id,
+            "rating": rating, "timestamp": timestamp
+        })
+    # Ответ - только после записи голоса на диск (ждем вне блокировки)
+    state_backend.wait_durable(seq)
+    return old_rating
+
+def delete_vote(location_id: int, user_id: str) -> Optional[int]:
+    """Удалить голос пользователя, возвращает удаленную оценку"""
+    timestamp = datetime.now().isoformat()
+    with location_lock(location_id):
+        old_rating = _drop_vote(location_id, user_id, timestamp)
+        seq = 0
+        if old_rating is not None:
+            seq = state_backend.append("voting", {
+                "op": "unvote", "location_id": location_id, "user_id": user_id, "timestamp": timestamp
+            })
+    state_backend.wait_durable(seq)
+    return old_rating
+
+def apply_vote_batch(batch: List[Any]):
+    """
+    Запись пачки голосов из очереди: [((location_id, user_id), {"rating", "timestamp"})].
+    Голоса за одну локацию записываются под одним захватом ее блокировки
+    """
+    by_location = {}
+    for (location_id, user_id), vote in batch:
+        by_location.setdefault(location_id, []).append((user_id, vote))
+    
+    seq = 0
+    for location_id, votes in by_location.items():
+        with location_lock(location_id):
+            for user_id, vote in votes:
+                _store_vote(location_id, user_id, vote["rating"], vote["timestamp"])
+                seq = state_backend.append("voting", {
+                    "op": "vote", "location_id": location_id, "user_id": user_id,
+                    "rating": vote["rating"], "timestamp": vote["timestamp"]
+                })
+    state_backend.wait_durable(seq)
+
+vote_queue = VoteQueue(apply_vote_batch, VOTE_QUEUE_SIZE, VOTE_BATCH_SIZE, VOTE_FLUSH_INTERVAL_SECONDS)
+
+def flush_pending_vote(location_id: int, user_id: str):
+    """Записать голос пользователя из очереди сразу (перед синхронным изменением)"""
+    vote = vote_queue.take((location_id, user_id))
+    if vote is not None:
+        apply_vote_batch([((location_id, user_id), vote)])
+
+def get_vote(location_id: int, user_id: str) -> Optional[Dict[str, Any]]:
+    """Голос пользователя за локацию: {"rating", "timestamp"} или None"""
+    vote = votes_storage.get(location_id, user_id)
+    if vote is None:
+        return None
+    return {"rating": vote[0], "timestamp": from_epoch(vote[1])}
+
+def location_columns(location_id: int):
+    """Копия столбцов голосов локации (оценки, время) или None, если голосов нет"""
+    with location_lock(location_id):
+        votes = votes_storage.location(location_id)
+        if votes is None:
+            return None
+        return votes.ratings[:], votes.timestamps[:]
+
+def get_stats(location_id: int) -> Optional[Dict[str, Any]]:
+    """Согласованная копия статистики локации"""
+    with location_lock(location_id):
+        stats = location_stats.get(location_id)
+        if stats is None:
+            return None
+        return {**stats, "distribution": list(stats["distribution"])}
+
+def _store_session(session_id: str, user_id: str, last_activity: datetime):
+    # Записи сессий не ждут fsync: после сбоя может потеряться последнее
+    # продление или новая сессия без голосов (клиент получит новую). Сессию,
+    # с которой проголосовали, сохраняет ожидание записи голоса - она идет раньше
+    if session_id not in user_sessions:
+        heapq.heappush(session_expiry_heap, (last_activity + timedelta(hours=SESSION_DURATION_HOURS), session_id))
+    user_sessions[session_id] = {
+        "user_id": user_id,
+        "last_activity": last_activity
+    }
+    state_backend.append("voting", {
+        "op": "session", "session_id": session_id, "user_id": user_id,
+        "last_activity": last_activity.isoformat()
+    })
 
 def get_or_create_user_id(session_id: Optional[str] = None) -> str:
     """Получить или создать ID пользователя"""
-    if not session_id or session_id not in user_sessions:
-        new_session_id = str(uuid.uuid4())
-        user_id = str(uuid.uuid4())
-        user_sessions[new_session_id] = {
-            "user_id": user_id,
-            "last_activity": datetime.now()
+    now = datetime.now()
+    with session_lock:
+        if not session_id or session_id not in user_sessions:
+            session_id = str(uuid.uuid4())
+            user_id = str(uuid.uuid4())
+        else:
+            user_id = user_sessions[session_id]["user_id"]
+        _store_session(session_id, user_id, now)
+    return session_id, user_id
+
+def cleanup_expired_sessions(now: Optional[datetime] = None) -> int:
+    """
+    Очистка просроченных сессий.
+    Просматриваются только сессии, срок которых уже подошел по очереди
+    """
+    now = now or datetime.now()
+    removed = 0
+    with session_lock:
+        while session_expiry_heap and session_expiry_heap[0][0] <= now:
+            _, session_id = heapq.heappop(session_expiry_heap)
+            session_data = user_sessions.get(session_id)
+            if session_data is None:
+                continue
+            
+            expires_at = session_data["last_activity"] + timedelta(hours=SESSION_DURATION_HOURS)
+            if expires_at > now:
+                # Сессия продлевалась - проверим ее снова, когда истечет новый срок
+                heapq.heappush(session_expiry_heap, (expires_at, session_id))
+            else:
+                del user_sessions[session_id]
+                state_backend.append("voting", {"op": "session_end", "session_id": session_id})
+                removed += 1
+    return removed
+
+def export_state() -> Dict[str, Any]:
+    """Копия голосов и сессий для снимка журнала"""
+    with all_locks():
+        return {
+            "votes": [
+                [location_id, user_id, rating, from_epoch(seconds)]
+                for location_id, user_id, rating, seconds in votes_storage.items()
+            ],
+            "sessions": [
+                [session_id, session["user_id"], session["last_activity"].isoformat()]
+                for session_id, session in user_sessions.items()
+            ]
         }
-        return new_session_id, user_id
-    
-    
-    user_sessions[session_id]["last_activity"] = datetime.now()
-    return session_id, user_sessions[session_id]["user_id"]
-
-def cleanup_expired_sessions():
-    """Очистка просроченных сессий"""
-    expired_sessions = []
-    for session_id, session_data in user_sessions.items():
-        if datetime.now() - session_data["last_activity"] > timedelta(hours=SESSION_DURATION_HOURS):
-            expired_sessions.append(session_id)
-    
-    for session_id in expired_sessions:
-        del user_sessions[session_id]
+
+def restore_state(state: Dict[str, Any]):
+    """Загрузка голосов и сессий из снимка (текущее состояние заменяется)"""
+    with all_locks():
+        votes_storage.clear()
+        user_sessions.clear()
+        session_expiry_heap.clear()
+        location_stats.clear()
+        for leaderboard in leaderboards.values():
+            leaderboard.clear()
+        vote_log.clear()
+        # В порядке времени, чтобы /recent-votes после перезапуска работал как раньше
+        for location_id, user_id, rating, timestamp in sorted(state["votes"], key=lambda vote: vote[3]):
+            _store_vote(location_id, user_id, rating, timestamp)
+        for session_id, user_id, last_activity in state["sessions"]:
+            _store_session(session_id, user_id, datetime.fromisoformat(last_activity))
+        bump_version("votes")
+
+def apply_record(record: Dict[str, Any]):
+    """Применение записи журнала"""
+    op = record["op"]
+    if op == "vote":
+        with location_lock(record["location_id"]):
+            _store_vote(record["location_id"], record["user_id"], record["rating"], record["timestamp"])
+    elif op == "unvote":
+        with location_lock(record["location_id"]):
+            _drop_vote(record["location_id"], record["user_id"], record["timestamp"])
+    elif op == "session":
+        with session_lock:
+            _store_session(record["session_id"], record["user_id"], datetime.fromisoformat(record["last_activity"]))
+    elif op == "session_end":
+        with session_lock:
+            user_sessions.pop(record["session_id"], None)
+
+state_backend.register("voting", export_state, restore_state, apply_record)
+
+async def session_cleanup_loop():
+    """Фоновая задача: периодическая очистка просроченных сессий"""
+    while True:
+        await asyncio.sleep(SESSION_CLEANUP_INTERVAL_SECONDS)
+        cleanup_expired_sessions()
 
 @router.post("/{location_id}/rate")
 def rate_location(
@@ -55,14 +346,10 @@ def rate_location(
             detail=f"Рейтинг должен быть от {MIN_RATING} до {MAX_RATING}"
         )
     
-   
-    cleanup_expired_sessions()
-    
-    
     new_session_id, user_id = get_or_create_user_id(session_id)
     
     # Устанавливаем куки, если это новая сессия
-    if not session_id:
+    if new_session_id != session_id:
         response.set_cookie(
             key="session_id",
             value=new_session_id,
@@ -70,21 +357,25 @@ def rate_location(
             max_age=SESSION_DURATION_HOURS * 3600
         )
     
-   
-    if location_id not in votes_storage:
-        votes_storage[location_id] = {}
-    
     
-    votes_storage[location_id][user_id] = {
-        "rating": rating,
-        "timestamp": datetime.now().isoformat()
-    }
+    if VOTE_QUEUE_ENABLED:
+        try:
+            vote_queue.put((location_id, user_id), {"rating": rating, "timestamp": datetime.now().isoformat()})
+        except QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Слишком много оценок, попробуйте позже",
+                headers={"Retry-After": "1"}
+            )
+    else:
+        set_vote(location_id, user_id, rating)
     
     return {
         "message": "Спасибо за вашу оценку!",
         "location_id": location_id,
         "rating": rating,
-        "user_voted": True
+        "user_voted": True,
+        "queued": VOTE_QUEUE_ENABLED
     }
 
 @router.get("/{location_id}/stats")
@@ -92,7 +383,9 @@ def get_location_voting_stats(location_id: int):
     """
     Получить статистику голосования для локации
     """
-    if location_id not in votes_storage or not votes_storage[location_id]:
+    stats = get_stats(location_id)
+    
+    if stats is None:
         return {
             "location_id": location_id,
             "average_rating": 0,
@@ -101,20 +394,15 @@ def get_location_voting_stats(location_id: int):
             "message": "Пока нет оценок для этой локации"
         }
     
-    votes = votes_storage[location_id]
-    ratings = [vote_data["rating"] for vote_data in votes.values()]
-    
-   
-    average_rating = sum(ratings) / len(ratings)
-    rating_distribution = {str(i): 0 for i in range(MIN_RATING, MAX_RATING + 1)}
-    
-    for rating in ratings:
-        rating_distribution[str(rating)] += 1
+    rating_distribution = {
+        str(rating): count
+        for rating, count in zip(range(MIN_RATING, MAX_RATING + 1), stats["distribution"])
+    }
     
     return {
         "location_id": location_id,
-        "average_rating": round(average_rating, 2),
-        "total_votes": len(ratings),
+        "average_rating": average_rating(stats),
+        "total_votes": stats["total_votes"],
         "rating_distribution": rating_distribution,
         "max_rating": MAX_RATING,
         "min_rating": MIN_RATING
@@ -123,30 +411,39 @@ def get_location_voting_stats(location_id: int):
 @router.get("/{location_id}/my-rating")
 def get_my_rating(
     location_id: int,
+    include_pending: bool = False,
     session_id: Optional[str] = Cookie(None)
 ):
     """
-    Получить мою оценку для локации
+    Получить мою оценку для локации.
+    include_pending=true - учесть оценку, которая еще ждет записи в очереди
     """
-    if not session_id or session_id not in user_sessions:
+    session = user_sessions.get(session_id) if session_id else None
+    if session is None:
         return {
             "location_id": location_id,
             "has_voted": False,
             "message": "Вы еще не оценивали эту локацию"
         }
     
-    user_id = user_sessions[session_id]["user_id"]
+    rating_data = None
+    pending = False
+    if include_pending:
+        rating_data = vote_queue.pending_vote((location_id, session["user_id"]))
+        pending = rating_data is not None
+    if rating_data is None:
+        rating_data = get_vote(location_id, session["user_id"])
     
-    if (location_id in votes_storage and 
-        user_id in votes_storage[location_id]):
-        
-        rating_data = votes_storage[location_id][user_id]
-        return {
+    if rating_data is not None:
+        result = {
             "location_id": location_id,
             "has_voted": True,
             "my_rating": rating_data["rating"],
             "voted_at": rating_data["timestamp"]
         }
+        if pending:
+            result["pending"] = True
+        return result
     else:
         return {
             "location_id": location_id,
@@ -163,7 +460,8 @@ def update_rating(
     """
     Обновить свою оценку локации
     """
-    if not session_id or session_id not in user_sessions:
+    session = user_sessions.get(session_id) if session_id else None
+    if session is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Необходимо сначала оценить локацию"
@@ -175,22 +473,17 @@ def update_rating(
             detail=f"Рейтинг должен быть от {MIN_RATING} до {MAX_RATING}"
         )
     
-    user_id = user_sessions[session_id]["user_id"]
-    
-    if (location_id not in votes_storage or 
-        user_id not in votes_storage[location_id]):
+    # Сначала записываем голос, который еще ждет в очереди
+    flush_pending_vote(location_id, session["user_id"])
+    # Проверка и обновление под одной блокировкой: голос не "воскреснет",
+    # если его удалили параллельным запросом
+    old_rating = set_vote(location_id, session["user_id"], new_rating, only_existing=True)
+    if old_rating is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Сначала нужно оценить локацию"
         )
     
-    # Обновляем оценку
-    old_rating = votes_storage[location_id][user_id]["rating"]
-    votes_storage[location_id][user_id] = {
-        "rating": new_rating,
-        "timestamp": datetime.now().isoformat()
-    }
-    
     return {
         "message": "Оценка обновлена",
         "location_id": location_id,
@@ -206,23 +499,15 @@ def remove_rating(
     """
     Удалить свою оценку локации
     """
-    if not session_id or session_id not in user_sessions:
+    session = user_sessions.get(session_id) if session_id else None
+    if session is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Не авторизован"
         )
     
-    user_id = user_sessions[session_id]["user_id"]
-    
-    if (location_id in votes_storage and 
-        user_id in votes_storage[location_id]):
-        
-        del votes_storage[location_id][user_id]
-        
-       
-        if not votes_storage[location_id]:
-            del votes_storage[location_id]
-        
+    flush_pending_vote(location_id, session["user_id"])
+    if delete_vote(location_id, session["user_id"]) is not None:
         return {
             "message": "Ваша оценка удалена",
             "location_id": location_id
@@ -234,58 +519,122 @@ def remove_rating(
         )
 
 @router.get("/top-rated")
-def get_top_rated_locations(limit: int = 10):
+def get_top_rated_locations(request: Request, limit: int = 10, ranking: str = "average"):
     """
-    Получить топ локаций по рейтингу
+    Получить топ локаций по рейтингу.
+    ranking=weighted - байесовский рейтинг, не дающий локациям с 1-2 голосами обойти популярные
     """
-    location_stats = []
+    if ranking not in leaderboards:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестный тип рейтинга. Доступные: {', '.join(leaderboards)}"
+        )
     
-    for location_id in votes_storage:
-        if votes_storage[location_id]:
-            ratings = [vote_data["rating"] for vote_data in votes_storage[location_id].values()]
-            average_rating = sum(ratings) / len(ratings)
-            location_stats.append({
+    def build():
+        top_locations = []
+        
+        for location_id in leaderboards[ranking].top(limit):
+            stats = get_stats(location_id)
+            if stats is None:
+                # Последний голос удалили, пока собирался ответ
+                continue
+            location = {
                 "location_id": location_id,
-                "average_rating": round(average_rating, 2),
-                "total_votes": len(ratings)
-            })
+                "average_rating": average_rating(stats),
+                "total_votes": stats["total_votes"]
+            }
+            if ranking == "weighted":
+                location["weighted_rating"] = weighted_rating(stats)
+            top_locations.append(location)
+        
+        return FastJSONResponse({
+            "top_locations": top_locations,
+            "limit": limit
+        })
     
+    return versioned_response(request, ("votes",), ("top-rated", limit, ranking), build)
+
+@router.get("/queue-stats")
+def get_vote_queue_stats():
+    """
+    Состояние очереди голосов: глубина, заполненность, принятые, объединенные
+    и отклоненные из-за переполнения голоса, размеры пачек
+    """
+    return {"enabled": VOTE_QUEUE_ENABLED, **vote_queue.stats()}
+
+@router.get("/analytics/histogram")
+def get_rating_histogram(days: Optional[int] = Query(None, ge=1, le=3660)):
+    """
+    Распределение оценок по всем локациям.
+    days - учитывать только голоса за последние days дней.
+    Результат пересчитывается не чаще раза в минуту
+    """
+    def compute():
+        histogram = [0] * (MAX_RATING - MIN_RATING + 1)
+        for location_id in votes_storage.location_ids():
+            if days is None:
+                stats = get_stats(location_id)
+                counts = stats["distribution"] if stats else []
+            else:
+                columns = location_columns(location_id)
+                if columns is None:
+                    continue
+                since = int(time.time()) - days * SECONDS_PER_DAY
+                counts = rating_histogram(*columns, since, MIN_RATING, MAX_RATING)
+            for i, count in enumerate(counts):
+                histogram[i] += count
+        return {
+            "days": days,
+            "total_votes": sum(histogram),
+            "rating_distribution": {
+                str(rating): count for rating, count in zip(range(MIN_RATING, MAX_RATING + 1), histogram)
+            }
+        }
     
-    sorted_locations = sorted(
-        location_stats, 
-        key=lambda x: (x["average_rating"], x["total_votes"]), 
-        reverse=True
-    )[:limit]
+    return cached(("histogram", days), compute)
+
+@router.get("/{location_id}/analytics/daily")
+def get_daily_votes(
+    location_id: int,
+    days: int = Query(30, ge=1, le=366),
+    window: int = Query(7, ge=1, le=90)
+):
+    """
+    Голоса за локацию по дням (UTC) за последние days дней: число голосов,
+    средняя оценка и скользящая средняя за window дней.
+    Результат пересчитывается не чаще раза в минуту
+    """
+    def compute():
+        columns = location_columns(location_id) or (array("b"), array("i"))
+        return {
+            "location_id": location_id,
+            "days": days,
+            "window": window,
+            "series": daily_series(*columns, days, window)
+        }
     
-    return {
-        "top_locations": sorted_locations,
-        "limit": limit
-    }
+    return cached(("daily", location_id, days, window), compute)
 
 @router.get("/recent-votes")
-def get_recent_votes(limit: int = 20):
+def get_recent_votes(limit: int = 20, since: Optional[int] = None):
     """
-    Получить последние оценки
+    Получить последние оценки.
+    since - курсор из предыдущего ответа, чтобы получить только новые оценки
+    (если их больше limit, остальные придут по следующему курсору)
     """
-    all_votes = []
-    
-    for location_id in votes_storage:
-        for user_id, vote_data in votes_storage[location_id].items():
-            all_votes.append({
-                "location_id": location_id,
-                "user_id": user_id[:8] + "...", 
-                "rating": vote_data["rating"],
-                "timestamp": vote_data["timestamp"]
-            })
-    
-    
-    sorted_votes = sorted(
-        all_votes, 
-        key=lambda x: x["timestamp"], 
-        reverse=True
-    )[:limit]
+    events, cursor = vote_log.recent_votes(limit, since)
+    recent_votes = [
+        {
+            "location_id": event["location_id"],
+            "user_id": event["user_id"][:8] + "...",
+            "rating": event["rating"],
+            "timestamp": event["timestamp"]
+        }
+        for event in events
+    ]
     
     return {
-        "recent_votes": sorted_votes,
-        "limit": limit
-    }
\ No newline at end of file
+        "recent_votes": recent_votes,
+        "limit": limit,
+        "cursor": cursor
+    }